@@ -1,20 +1,78 @@
 #!/usr/bin/python3
 
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from Scrapers import scraper
+from Scrapers.Archive import memory
+from Scrapers.Cache import HttpCache
+from Scrapers.Chapter import ChapterList
+from Scrapers.Metrics import metrics
+from Scrapers.Profile import profiler
+from Scrapers.Recompress import check_format, Recompressor
+from Scrapers.Schedule import Schedule
+from Scrapers.Scheduler import Scheduler
+from Scrapers.Output import output, print_info
+from Scrapers.Partial import PartialDownloads
+from Scrapers.Pipeline import Pipeline
+from Scrapers.State import DownloadState
+from Scrapers.Store import ImageStore
+from Scrapers.Throttle import Throttle
+from Scrapers.Transport import download_errors
 import logging
 import getopt
+import heapq
 import os
 import re
 import sys
-
-logging.basicConfig(level=logging.DEBUG, format='%(levelname)s: %(module)s: %(funcName)s: %(msg)s')
-
-
-def print_info(message, newline=True):
-    if not config.quiet_mode:
-        if not newline:
-            print(message, end="")
-        else:
-            print(message)
+import time
+
+
+LOG_FORMAT = '%(levelname)s: %(module)s: %(funcName)s: %(message)s'
+# Most recent samples every histogram keeps in --watch mode.
+WATCH_SAMPLES = 10000
+
+# Configuration and session of a batch worker process, set up by its first series.
+worker = None
+
+
+class Configuration(object):
+    def __init__(self):
+        self.limit = None
+        self.archivers = 1
+        self.bandwidth = None
+        self.chapter_workers = 1
+        self.connections = None
+        self.resolvers = 2
+        self.series_workers = 1
+        self.batch_file = None
+        self.metrics_file = None
+        self.profile_directory = None
+        self.stats = False
+        self.store_directory = None
+        self.cache_directory = None
+        self.cache_size = 100
+        self.chapter_end = None
+        self.chapter_start = None
+        self.download_directory = None
+        self.download_server = None
+        self.file_extension = 'zip'
+        self.force = False
+        self.group_preference = None
+        self.host_bandwidth = None
+        self.interactive_mode = False
+        self.jobs = os.cpu_count() or 1
+        self.memory = 64
+        self.page_workers = 4
+        self.quality = 85
+        self.max_size = None
+        self.recompress = None
+        self.quiet_mode = False
+        self.rate = None
+        self.retries = 3
+        self.urls = None
+        self.verify = False
+        self.watch = False
+        self.watch_interval = 15
 
 
 def clean_filename(filename, underscore=True):
@@ -25,7 +83,8 @@ def clean_filename(filename, underscore=True):
     return filename
 
 
-def duplicate_chapters(chapters):
+def duplicate_chapters(manga, chapters, config):
+    """Picks one release of every chapter that has several and returns the ChapterList without the others."""
     numbers = ["Zero", "One", "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine"]
 
     def print_initial():
@@ -35,61 +94,35 @@ def duplicate_chapters(chapters):
             number_of_releases = numbers[len(duplicates)]
 
         if manga.uses_groups:
-            try:
-                print_info("{} releases for chapter {:g}: ".format(number_of_releases, duplicates[0]["chapter"]),
-                           newline=False)
-            except ValueError:
-                print_info("{} releases for chapter {}: ".format(number_of_releases, duplicates[0]["chapter"]),
-                           newline=False)
+            print_info("{} releases for chapter {}: ".format(number_of_releases, duplicates[0].label), newline=False)
             for item in duplicates[:-1]:
                 print_info("{}, ".format(item["group"]), newline=False)
             print_info("{}.".format(duplicates[-1]["group"]))
         else:
-            try:
-                print_info("{} releases for chapter {:g}".format(number_of_releases, duplicates[0]["chapter"]))
-            except ValueError:
-                print_info("{} releases for chapter {}".format(number_of_releases, duplicates[0]["chapter"]))
+            print_info("{} releases for chapter {}".format(number_of_releases, duplicates[0].label))
 
     def no_preference():
         print_initial()
 
         if manga.uses_groups:
-            try:
-                print_info("No preference set. Picking {} for chapter {:g}.".format(duplicates[0]["group"],
-                                                                                    chapter["chapter"]))
-            except ValueError:
-                print_info(
-                    "No preference set. Picking {} for chapter {}.".format(duplicates[0]["group"], chapter["chapter"]))
+            print_info("No preference set. Picking {} for chapter {}.".format(duplicates[0]["group"],
+                                                                              duplicates[0].label))
         else:
             print_info("No preference set. Picking latter chapter.")
 
-        for item in duplicates[1:]:
-            chapters.remove(item)
+        return duplicates[0]
 
     def preference(group):
         print_initial()
 
         for item in duplicates:
             if item["group"] == group:
-                try:
-                    print_info(
-                        "Preference: {}. Picking {} for chapter {:g}.".format(group, item["group"], item["chapter"]))
-                except ValueError:
-                    print_info(
-                        "Preference: {}. Picking {} for chapter {}.".format(group, item["group"], item["chapter"]))
-                duplicates.remove(item)
-                for item in duplicates:
-                    chapters.remove(item)
-                return
+                print_info("Preference: {}. Picking {} for chapter {}.".format(group, item["group"], item.label))
+                return item
 
-        try:
-            print_info("Preference: {}. Not found. Picking {} for chapter {:g}.".format(group, duplicates[-1]["group"],
-                                                                                        duplicates[-1]["chapter"]))
-        except ValueError:
-            print_info("Preference: {}. Not found. Picking {} for chapter {}.".format(group, duplicates[-1]["group"],
-                                                                                      duplicates[-1]["chapter"]))
-        for item in duplicates[:-1]:
-            chapters.remove(item)
+        print_info("Preference: {}. Not found. Picking {} for chapter {}.".format(group, duplicates[-1]["group"],
+                                                                                  duplicates[-1].label))
+        return duplicates[-1]
 
     def interactive():
         print_initial()
@@ -100,70 +133,48 @@ def duplicate_chapters(chapters):
             else:
                 print("{}. Release {}".format(num, num))
 
-        # Try to delete the given item from the duplicates list. Loops until a valid item is entered.
+        # Try to pick the given item from the duplicates list. Loops until a valid item is entered.
         while (True):
             choice = input('>> ')
             try:
-                if manga.uses_groups:
-                    try:
-                        print_info("Picking {} for chapter {:g}.".format(duplicates[int(choice) - 1]["group"],
-                                                                         duplicates[int(choice) - 1]["chapter"]))
-                    except ValueError:
-                        print_info("Picking {} for chapter {}.".format(duplicates[int(choice) - 1]["group"],
-                                                                       duplicates[int(choice) - 1]["chapter"]))
-                else:
-                    try:
-                        print_info("Picking release {} for chapter {:g}.".format(int(choice),
-                                                                                 duplicates[int(choice) - 1][
-                                                                                     "chapter"]))
-                    except ValueError:
-                        print_info("Picking release {} for chapter {}.".format(int(choice),
-                                                                               duplicates[int(choice) - 1]["chapter"]))
-                del duplicates[int(choice) - 1]
-                break
-            except ValueError as e:
+                if int(choice) < 1:
+                    raise ValueError("invalid choice: '{}'".format(choice))
+                item = duplicates[int(choice) - 1]
+            except (ValueError, IndexError) as e:
                 print("Invalid input.", e)
-        # Deletes all the chapters that are in the duplicates list from the chapter list
-        # since the version to keep is no longer on that list.
-        for item in duplicates:
-            chapters.remove(item)
+                continue
+            if manga.uses_groups:
+                print_info("Picking {} for chapter {}.".format(item["group"], item.label))
+            else:
+                print_info("Picking release {} for chapter {}.".format(int(choice), item.label))
+            return item
 
     logging.debug('Searching duplicate chapters')
-    for num, chapter in enumerate(chapters):
-        duplicates = [chapter]
-        for chapter2 in chapters[num + 1:]:
-            if chapter["chapter"] == chapter2["chapter"]:
-                duplicates.append(chapter2)
-        if len(duplicates) > 1:
-            if config.interactive_mode:
-                interactive()
-            elif config.group_preference is not None:
-                if manga.uses_groups:
-                    preference(config.group_preference)
-                else:
-                    logging.debug('Unable to use group preference with site: using no_preference as fallback')
-                    no_preference()
+    dropped = []
+    for duplicates in chapters.duplicates():
+        if config.interactive_mode:
+            keep = interactive()
+        elif config.group_preference is not None:
+            if manga.uses_groups:
+                keep = preference(config.group_preference)
             else:
-                no_preference()
+                logging.debug('Unable to use group preference with site: using no_preference as fallback')
+                keep = no_preference()
+        else:
+            keep = no_preference()
+        # Drops every release of the chapter but the one to keep.
+        dropped += [item for item in duplicates if item is not keep]
     logging.debug('Duplicate chapter search finished')
+    return chapters.without(dropped)
 
 
-def generate_config():
-    class Configuration(object):
-        def __init__(self):
-            self.limit = None
-            self.chapter_end = None
-            self.chapter_start = None
-            self.download_directory = None
-            self.download_server = None
-            self.file_extension = 'zip'
-            self.group_preference = None
-            self.interactive_mode = False
-            self.quiet_mode = False
-            self.urls = None
-
+def generate_config(argv=None, prompt=False):
+    """Returns the Configuration of the command-line arguments argv (sys.argv by default) after those of the
+    configuration file. With prompt, the URL is asked for when no URL or --batch is given."""
     config = Configuration()
     config_file = os.environ['HOME'] + '/.config/mangacrawler.conf'
+    if argv is None:
+        argv = sys.argv[1:]
 
     user_config = []
     # Open the config file for reading, go through it line by line and if line doesn't start with #, add it as a arg.
@@ -173,38 +184,95 @@ def generate_config():
                 if line[0] != '#':
                     user_config += line.split()
 
-    arguments = user_config + sys.argv[1:]
-    optlist, args = getopt.getopt(arguments, 'm:e:d:qs:s',
-                                  ['cbz', 'debug', 'interactive', 'prefer-group=', 'quiet', 'server='])
-    logging.debug('User config: ' + str(user_config))
-    logging.debug('Command-line args: ' + str(sys.argv[1:]))
+    arguments = user_config + argv
+    optlist, args = getopt.getopt(arguments, 'm:e:d:j:qs:st:',
+                                  ['archivers=', 'bandwidth=', 'batch=', 'cache=', 'cache-size=', 'cbz',
+                                   'chapter-workers=', 'connections=', 'debug', 'force', 'host-bandwidth=',
+                                   'interactive', 'jobs=', 'max-size=', 'memory=', 'metrics-file=',
+                                   'prefer-group=', 'profile=', 'quality=', 'quiet', 'rate=', 'recompress=',
+                                   'resolvers=', 'retries=', 'series-workers=', 'server=', 'stats', 'store=',
+                                   'verify', 'watch', 'watch-interval='])
+    logging.debug('User config: %s', user_config)
+    logging.debug('Command-line args: %s', argv)
 
     if len(optlist) > 0:
         for opt, arg in optlist:
-            if opt == '--cbz':
+            if opt == '--archivers':
+                setattr(config, 'archivers', max(1, int(arg)))
+            elif opt == '--bandwidth':
+                setattr(config, 'bandwidth', float(arg))
+            elif opt == '--batch':
+                setattr(config, 'batch_file', arg if arg == '-' else os.path.abspath(os.path.expanduser(arg)))
+            elif opt == '--cache':
+                setattr(config, 'cache_directory', os.path.abspath(os.path.expanduser(arg)))
+            elif opt == '--cache-size':
+                setattr(config, 'cache_size', int(arg))
+            elif opt == '--cbz':
                 setattr(config, 'file_extension', 'cbz')
+            elif opt == '--chapter-workers':
+                setattr(config, 'chapter_workers', max(1, int(arg)))
+            elif opt == '--connections':
+                setattr(config, 'connections', max(1, int(arg)))
             elif opt == '-d':
                 setattr(config, 'download_directory', os.path.abspath(os.path.expanduser(arg)))
             elif opt == '-m':
                 setattr(config, 'limit', arg)
             elif opt == '--debug':
                 logging.getLogger().setLevel(logging.DEBUG)
+            elif opt == '--force':
+                setattr(config, 'force', True)
+            elif opt == '--host-bandwidth':
+                setattr(config, 'host_bandwidth', float(arg))
             elif opt == '-e':
                 setattr(config, 'chapter_end', arg)
             elif opt == '--interactive':
                 setattr(config, 'interactive_mode', True)
+            elif opt in ('-j', '--jobs'):
+                setattr(config, 'jobs', max(1, int(arg)))
+            elif opt == '--max-size':
+                setattr(config, 'max_size', int(arg))
+            elif opt == '--memory':
+                setattr(config, 'memory', int(arg))
+            elif opt == '--metrics-file':
+                setattr(config, 'metrics_file', os.path.abspath(os.path.expanduser(arg)))
             elif opt == '--prefer-group':
                 setattr(config, 'group_preference', arg)
+            elif opt == '--profile':
+                setattr(config, 'profile_directory', os.path.abspath(os.path.expanduser(arg)))
             elif opt == '-q':
                 setattr(config, 'quiet_mode', True)
             elif opt == '--quiet':
                 setattr(config, 'quiet_mode', True)
+            elif opt == '--quality':
+                setattr(config, 'quality', int(arg))
+            elif opt == '--rate':
+                setattr(config, 'rate', float(arg))
+            elif opt == '--recompress':
+                setattr(config, 'recompress', arg.lower().replace('jpg', 'jpeg'))
+            elif opt == '--resolvers':
+                setattr(config, 'resolvers', max(1, int(arg)))
+            elif opt == '--retries':
+                setattr(config, 'retries', int(arg))
             elif opt == '-s':
                 setattr(config, 'chapter_start', arg)
+            elif opt == '--series-workers':
+                setattr(config, 'series_workers', max(1, int(arg)))
             elif opt == '--server':
                 setattr(config, 'download_server', arg)
-
-    if len(args) == 0:
+            elif opt == '--stats':
+                setattr(config, 'stats', True)
+            elif opt == '--store':
+                setattr(config, 'store_directory', os.path.abspath(os.path.expanduser(arg)))
+            elif opt == '--verify':
+                setattr(config, 'verify', True)
+            elif opt == '--watch':
+                setattr(config, 'watch', True)
+            elif opt == '--watch-interval':
+                setattr(config, 'watch_interval', float(arg))
+            elif opt == '-t':
+                setattr(config, 'page_workers', max(1, int(arg)))
+
+    if len(args) == 0 and config.batch_file is None and prompt:
         url = input('>> ')
         setattr(config, 'urls', [url])
     else:
@@ -213,89 +281,79 @@ def generate_config():
     return config
 
 
-config = generate_config()
-warnings = []
+def crawl(url, config, **resources):
+    """Downloads the chapters of a series or chapter URL as set in config and returns the warnings of the download.
+    Raises ValueError if no scraper supports the URL, and one of download_errors if its series page cannot be opened.
+    A long-lived process can call it for many URLs, sharing the HttpCache, Throttle, ImageStore, Recompressor and
+    Scheduler of a session (cache, throttle, store, recompressor and scheduler) between the calls, also from several
+    threads at once."""
+    configure(config)
+    with open_series(url, config, **resources) as manga:
+        if manga.series is None:
+            return []
+        return download_chapters(manga, select_chapters(manga, config), config)
 
-for url in config.urls:
-    # Intializes the manga object if the URL is valid and has a scraper.
-    if re.match(r'.*bato\.to/.*', url):
-        from Scrapers import Batoto
-
-        manga = Batoto(url, server=config.download_server)
-        logging.debug('URL match: {}'.format(manga.site_name))
-    elif re.match(r'.*dynasty-scans\.com/.*', url):
-        from Scrapers import DynastyReader
-
-        manga = DynastyReader(url)
-        logging.debug('URL match: {}'.format(manga.site_name))
-    elif re.match(r'.*kissmanga\.com/manga/.*', url, flags=re.IGNORECASE):
-        from Scrapers import KissManga
-
-        manga = KissManga(url)
-        logging.debug('URL match: {}'.format(manga.site_name))
-    elif re.match(r'.*truyentranhtuan\.com/.*', url, flags=re.IGNORECASE):
-        from Scrapers import TruyenTranhTuan
-
-        manga = TruyenTranhTuan(url)
-        logging.debug('URL match: {}'.format(manga.site_name))
-    else:
-        print_info("Invalid input.")
-        exit()
-
-    if manga.page is None:
-        continue
 
+def open_series(url, config, cache=None, throttle=None, store=None, recompressor=None, scheduler=None):
+    """Returns the scraper object of a URL, which fetches its series page. It is to be closed once done with."""
+    # Intializes the manga object if the URL is valid and has a scraper.
+    site = scraper(url)
+    if site is None:
+        raise ValueError('No scraper for {}'.format(url))
+    with profiler.phase('series_fetch'):
+        manga = site(url, page_workers=config.page_workers, cache=cache, throttle=throttle, store=store,
+                     recompressor=recompressor, server=config.download_server, scheduler=scheduler)
+    logging.debug('URL match: %s', manga.site_name)
+    return manga
+
+
+def select_chapters(manga, config, known=None):
+    """Returns the ChapterList of the chapters of a series to download with the -s, -m and -e limits of config, and
+    a single release of each chapter. Chapters whose URL is in the set known are left out."""
     # Print a warning if the user tries to specify --prefer-group with a site that doesn't use group names.
     if not manga.uses_groups and config.group_preference is not None:
         print_info("WARNING: Unable to use '--prefer-group' with {}.".format(manga.site_name))
 
-    chapters = manga.series_chapters()[::-1]
+    chapters = ChapterList(manga.series_chapters()[::-1])
+    first, last = 0, len(chapters)
 
     # Look for the chapter to start from if '-s' is used.
     if config.chapter_start is not None and len(chapters) > 1:
-        chapter_count = len(chapters)
-        for num, chapter in enumerate(chapters):
-            try:
-                comparison = '{:g}'.format(chapter["chapter"])
-            except ValueError:
-                comparison = chapter["chapter"]
-            if config.chapter_start == comparison:
-                print_info("Starting download at chapter {}.".format(comparison))
-                del chapters[:num]
-                break
-            elif num == chapter_count - 1:
-                try:
-                    print_info(
-                        "Defined start chapter not found. Starting at chapter {:g}.".format(chapters[0]["chapter"]))
-                except ValueError:
-                    print_info(
-                        "Defined start chapter not found. Starting at chapter {}.".format(chapters[0]["chapter"]))
+        position = chapters.find(config.chapter_start)
+        if position is not None:
+            print_info("Starting download at chapter {}.".format(config.chapter_start))
+            first = position
+        else:
+            print_info("Defined start chapter not found. Starting at chapter {}.".format(chapters[0].label))
 
     if config.limit is not None and not manga.init_with_chapter:
-        logging.debug('Only get {} latest chapters'.format(config.limit))
-        chapters = chapters[0:int(config.limit)]
+        logging.debug('Only get %s latest chapters', config.limit)
+        last = min(last, first + int(config.limit))
 
     # Look for the chapter to end at if '-e' is used.
-    if config.chapter_end is not None and len(chapters) > 1:
-        chapter_count = len(chapters)
-        for num, chapter in enumerate(chapters):
-            try:
-                comparison = '{:g}'.format(chapter["chapter"])
-            except ValueError:
-                comparison = chapter["chapter"]
-            if config.chapter_end == comparison:
-                print_info("Ending download at chapter {}.".format(comparison))
-                del chapters[num + 1:]
-                break
-            elif num == chapter_count - 1:
-                try:
-                    print_info("Defined end chapter not found. Ending at chapter {:g}.".format(chapters[-1]["chapter"]))
-                except ValueError:
-                    print_info("Defined end chapter not found. Ending at chapter {}.".format(chapters[-1]["chapter"]))
+    if config.chapter_end is not None and last - first > 1:
+        position = chapters.find(config.chapter_end, first, last)
+        if position is not None:
+            print_info("Ending download at chapter {}.".format(config.chapter_end))
+            last = position + 1
+        else:
+            print_info("Defined end chapter not found. Ending at chapter {}.".format(chapters[last - 1].label))
+
+    chapters = chapters[first:last]
+
+    if known is not None:
+        chapters = chapters.without([chapter for chapter in chapters if chapter.url in known])
 
     if len(chapters) > 1:
-        duplicate_chapters(chapters)
+        with profiler.phase('duplicates'):
+            chapters = duplicate_chapters(manga, chapters, config)
+    return chapters
 
+
+def download_chapters(manga, chapters, config, complete=None):
+    """Downloads chapters into the download directory of config, skipping those that are complete there, and returns
+    the warnings of the download. The URLs of the chapters that are complete afterwards, with no page missing, are
+    added to the set complete if given."""
     if config.download_directory is not None:
         download_dir = config.download_directory.replace('%title_',
                                                          clean_filename(manga.series_info("title"), underscore=True))
@@ -305,30 +363,385 @@ for url in config.urls:
     else:
         download_dir = os.getcwd()
 
-    logging.debug("Download directory {}".format(download_dir))
-
-    for chapter in chapters:
-        try:
-            chapter_number = '{:g}'.format(chapter["chapter"])
-        except ValueError:
-            chapter_number = '{}'.format(chapter["chapter"])
+    logging.debug('Download directory %s', download_dir)
+    manga.state = DownloadState(download_dir)
+    manga.parts = PartialDownloads(os.path.join(download_dir, '.mangacrawler-parts'))
 
+    def print_chapter(chapter):
         if chapter["name"] is not None:
-            print_info("Chapter {} - {}".format(chapter_number, chapter["name"]))
+            print_info("Chapter {} - {}".format(chapter.label, chapter["name"]))
         else:
-            print_info("Chapter {}".format(chapter_number))
+            print_info("Chapter {}".format(chapter.label))
 
-        clean_title = clean_filename(manga.series_info("title"))
+    def fail(job, error):
+        print_info('WARNING: Unable to download chapter ({}).'.format(str(error)))
+        job["warnings"].append('Download of chapter {}, series "{}" failed.'.format(job["chapter"].label,
+                                                                                   manga.series_info("title")))
+        job["failed"] = True
 
+    clean_title = clean_filename(manga.series_info("title"))
+    jobs = []
+    for chapter in chapters:
         if type(chapter["chapter"]) == float:
             output_name = '{0}_c{1[0]:0>4}.{1[1]}.{2}'.format(clean_title, str(chapter["chapter"]).split('.'),
                                                               config.file_extension)
         else:
             output_name = '{0}_{1}.{2}'.format(clean_title, clean_filename(chapter["chapter"]), config.file_extension)
 
-        warnings += manga.download_chapter(chapter, download_dir, output_name)
+        # With --verify, archives already there are checked against the current pages of their chapter.
+        verify = config.verify and not config.force and os.path.exists(os.path.join(download_dir, output_name))
+        if not config.force and not verify and manga.state.is_complete(output_name):
+            print_chapter(chapter)
+            print_info("Already downloaded: {}".format(output_name))
+            if complete is not None:
+                complete.add(chapter.url)
+            continue
+
+        jobs.append({"chapter": chapter, "name": output_name, "image_urls": None, "finish": [], "warnings": [],
+                     "failed": False, "verify": verify, "missing": None})
+    # The newest chapters go first, as the Scheduler sends their images first.
+    jobs.sort(key=lambda job: manga.chapter_priority(job["chapter"]), reverse=True)
+
+    # Chapters go through three stages, each with its own threads: their pages are looked up ahead of the download,
+    # and the archives are finished while the next chapters download.
+    def resolve(job):
+        try:
+            with profiler.phase('page_list'):
+                job["image_urls"] = manga.chapter_pages(job["chapter"])
+            if not job["image_urls"]:
+                # An interstitial page or a layout the scraper does not know: the next run tries the chapter again.
+                fail(job, 'no pages found')
+                return job
+            if job["verify"]:
+                with profiler.phase('verify'):
+                    job["missing"] = manga.verify_archive(job["chapter"], job["image_urls"],
+                                                          os.path.join(download_dir, job["name"]))
+        except download_errors as e:
+            fail(job, e)
+        return job
+
+    def download(job):
+        if job["failed"]:
+            return job
+        print_chapter(job["chapter"])
+        if job["missing"] is not None:
+            if not job["missing"]:
+                print_info("Verified: {}".format(job["name"]))
+                return job
+            print_info("Repairing: {} of {} pages missing from {}".format(len(job["missing"]),
+                                                                        len(job["image_urls"]), job["name"]))
+        try:
+            job["warnings"] += manga.download_chapter(job["chapter"], download_dir, job["name"], job["image_urls"],
+                                                      job["finish"].append)
+        except download_errors as e:
+            fail(job, e)
+        return job
+
+    def archive(job):
+        for finish_archive in job["finish"]:
+            try:
+                finish_archive()
+            except OSError as e:
+                fail(job, e)
+        return job
+
+    # Verifying mostly waits for chapter pages, so archives are checked by as many threads as pages are downloaded.
+    resolvers = max(config.resolvers, config.page_workers) if config.verify else config.resolvers
+    try:
+        Pipeline([(resolve, resolvers), (download, config.chapter_workers), (archive, config.archivers)]).run(jobs)
+    finally:
+        manga.state.flush()
+
+    warnings = []
+    for job in jobs:
+        warnings += job["warnings"]
+        if complete is not None and not job["failed"] and manga.state.is_complete(job["name"]):
+            complete.add(job["chapter"].url)
+    return warnings
+
+
+def crawl_series(url, config, **resources):
+    """Runs crawl and turns any failure into a warning, so that one broken series does not stop the others"""
+    if scraper(url) is None:
+        print_info('WARNING: Invalid input: {}.'.format(url))
+        return ['No scraper for "{}".'.format(url)]
+    try:
+        return crawl(url, config, **resources)
+    except download_errors as e:
+        print_info('WARNING: Unable to open {} ({}).'.format(url, str(e)))
+    except Exception as e:
+        logging.exception('Crawling %s failed', url)
+        print_info('WARNING: Unable to download {} ({}).'.format(url, str(e)))
+    return ['Download of series "{}" failed.'.format(url)]
+
+
+def configure(config):
+    """Applies the settings of config that hold for the whole process: quiet mode and the memory of waiting pages"""
+    output.quiet = config.quiet_mode
+    memory.limit = config.memory * 1024 * 1024
+
+
+def session(config, recompress_workers=None, share=1):
+    """Returns the HttpCache, Throttle, ImageStore, Recompressor and Scheduler shared by the series of a process, as
+    arguments of crawl. The --connections and bandwidth caps of the Scheduler are divided by share, the number of
+    processes that download at once."""
+    configure(config)
+    throttle = Throttle(rate=config.rate, concurrency=config.page_workers, retries=config.retries)
+    # Pages ahead of their turn that wait for --memory keep their connection: one more than those of every series
+    # and chapter downloaded at once can hold is left for the pages that are due.
+    minimum = config.series_workers * config.chapter_workers * (config.page_workers - 1) + 1
+    if config.connections is not None:
+        connections = max(minimum, config.connections // share)
+    else:
+        connections = max(minimum, config.page_workers * config.chapter_workers + config.resolvers)
+    scheduler = Scheduler(connections,
+                          rate=config.bandwidth * 1024 / share if config.bandwidth else None,
+                          host_rate=config.host_bandwidth * 1024 / share if config.host_bandwidth else None)
+
+    if config.cache_directory is not None:
+        cache = HttpCache(config.cache_directory, max_size=config.cache_size * 1024 * 1024)
+    else:
+        cache = None
+
+    if config.store_directory is not None:
+        store = ImageStore(config.store_directory)
+    else:
+        store = None
 
-if len(warnings) > 0:
-    print('\nFollowing warnings were encountered during runtime:')
-    for warning in warnings:
-        print(warning)
+    if config.recompress is not None or config.max_size is not None:
+        recompressor = Recompressor(config.recompress or 'jpeg', quality=config.quality, max_size=config.max_size,
+                                    workers=recompress_workers)
+    else:
+        recompressor = None
+    return {"cache": cache, "throttle": throttle, "store": store, "recompressor": recompressor,
+            "scheduler": scheduler}
+
+
+def batch_urls(config):
+    """Yields the URLs given as arguments, then those of the batch file (stdin for '-'), one per line.
+    Blank lines and lines starting with # are skipped."""
+    yield from config.urls
+    if config.batch_file is None:
+        return
+    f = sys.stdin if config.batch_file == '-' else open(config.batch_file, 'r')
+    try:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def batch_crawl(url, config, level):
+    """Crawls one series in a batch worker process and returns its URL, warnings and the metrics and profile samples
+    it recorded"""
+    global worker
+    if worker is None:
+        if not logging.getLogger().handlers:
+            logging.basicConfig(level=level, format=LOG_FORMAT)
+        if config.profile_directory is not None:
+            profiler.start()
+        # Batch workers already spread over the CPUs and recompress pages themselves: a pool of their own would be
+        # left behind when the batch pool stops them. Each has a Scheduler of its own, with a share of the bandwidth.
+        worker = (config, session(config, recompress_workers=0, share=config.jobs))
+    config, resources = worker
+    warnings = crawl_series(url, config, **resources)
+    if resources["cache"] is not None:
+        resources["cache"].flush()
+    return url, warnings, metrics.drain(), profiler.drain()
+
+
+def run_batch(config):
+    """Spreads the series of batch_urls over config.jobs processes, keeping at most two per process queued, and
+    returns the warnings of all of them. The metrics and profile samples of the workers are merged into this
+    process. A series whose worker fails or dies only fails that series: when a worker dies, the series queued in
+    the pool fail with it and the next ones go to a new pool."""
+    warnings = []
+    pending = {}
+    broken = []
+
+    def collect(futures):
+        for future in futures:
+            url = pending.pop(future)
+            try:
+                _, series_warnings, (counters, samples), profile = future.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    broken.append(e)
+                logging.debug('Batch worker of %s failed: %r', url, e)
+                print_info('WARNING: Unable to download {} ({}).'.format(url, str(e) or type(e).__name__))
+                series_warnings = ['Download of series "{}" failed.'.format(url)]
+            else:
+                metrics.merge(counters, samples)
+                profiler.merge(profile)
+            metrics.count('series')
+            warnings.extend(series_warnings)
+            print_info('Finished {} ({} warnings).'.format(url, len(series_warnings)))
+
+    level = logging.getLogger().level
+    executor = ProcessPoolExecutor(max_workers=config.jobs)
+    try:
+        for url in batch_urls(config):
+            if len(pending) >= 2 * config.jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            try:
+                if broken:
+                    raise broken[0]
+                future = executor.submit(batch_crawl, url, config, level)
+            except BrokenProcessPool:
+                collect(wait(pending).done)
+                del broken[:]
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=config.jobs)
+                future = executor.submit(batch_crawl, url, config, level)
+            pending[future] = url
+        collect(wait(pending).done)
+    finally:
+        executor.shutdown()
+    return warnings
+
+
+def poll(url, config, listed, complete, **resources):
+    """Fetches a watched series and downloads its chapters that are not complete yet: those that were not listed at
+    its previous poll, and those that failed or are still missing pages. listed is the set of chapter URLs listed so
+    far and complete the set of those downloaded whole. Returns the warnings and the number of new chapters;
+    everything listed at the first poll is downloaded if missing, as in a normal run, but does not count as new."""
+    first = not listed
+    try:
+        with open_series(url, config, **resources) as manga:
+            if manga.series is None:
+                return [], 0
+            chapters = select_chapters(manga, config, complete)
+            new = [chapter for chapter in chapters if chapter.url not in listed]
+            listed.update(chapter.url for chapter in chapters)
+            if len(chapters) == 0:
+                return [], 0
+            if not first and new:
+                print_info("{} new chapters of {}.".format(len(new), manga.series_info("title")))
+            return download_chapters(manga, chapters, config, complete), 0 if first else len(new)
+    except download_errors as e:
+        print_info('WARNING: Unable to open {} ({}).'.format(url, str(e)))
+    except Exception as e:
+        logging.exception('Polling %s failed', url)
+        print_info('WARNING: Unable to download {} ({}).'.format(url, str(e)))
+    return ['Poll of series "{}" failed.'.format(url)], 0
+
+
+def watch(config, resources):
+    """Polls the series of batch_urls, each on its own Schedule, until interrupted. The warnings of every poll are
+    printed as soon as it is done, and the --metrics-file is rewritten."""
+    # The samples of the histograms would otherwise pile up for as long as the watch runs.
+    metrics.window = WATCH_SAMPLES
+    queue = []
+    schedules = {}
+    listed = {}
+    complete = {}
+    for position, url in enumerate(batch_urls(config)):
+        if scraper(url) is None:
+            print_info('WARNING: Invalid input: {}.'.format(url))
+            continue
+        schedules[url] = Schedule(minimum=config.watch_interval * 60)
+        listed[url] = set()
+        complete[url] = set()
+        heapq.heappush(queue, (time.time(), position, url))
+
+    try:
+        while queue:
+            when, position, url = heapq.heappop(queue)
+            time.sleep(max(0.0, when - time.time()))
+            warnings, found = poll(url, config, listed[url], complete[url], **resources)
+            metrics.count('polls')
+            metrics.count('new_chapters', found)
+            when = schedules[url].update(time.time(), found > 0)
+            heapq.heappush(queue, (when, position, url))
+            logging.info('Next poll of %s in %.1f minutes', url, (when - time.time()) / 60)
+
+            for warning in warnings:
+                print(warning)
+            if config.metrics_file is not None:
+                metrics.write(config.metrics_file)
+    except KeyboardInterrupt:
+        print_info('Stopped watching.')
+    return []
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    config = generate_config(argv, prompt=True)
+    configure(config)
+
+    if config.series_workers > 1 and config.interactive_mode:
+        print_info("WARNING: Unable to use '--interactive' with '--series-workers'.")
+        config.interactive_mode = False
+
+    batch = config.batch_file is not None and not config.watch
+    try:
+        if batch:
+            # Each batch worker builds the session of its own process: the process that forks them must not have
+            # started threads or processes of its own, which a fork can deadlock on.
+            resources = None
+            if config.recompress is not None or config.max_size is not None:
+                check_format(config.recompress or 'jpeg')
+        else:
+            resources = session(config)
+    except (ImportError, ValueError) as e:
+        print('ERROR: {}.'.format(e))
+        sys.exit(2)
+
+    if (config.batch_file is not None or config.watch) and config.interactive_mode:
+        print_info("WARNING: Unable to use '--interactive' with '--batch' or '--watch'.")
+        config.interactive_mode = False
+
+    # Batch workers sample their own stacks (see batch_crawl).
+    if config.profile_directory is not None and not batch:
+        profiler.start()
+    if config.watch:
+        warnings = watch(config, resources)
+    elif batch:
+        warnings = run_batch(config)
+    elif config.series_workers > 1:
+        # The series share the connections of the Scheduler, which hands them out fairly.
+        warnings = []
+        with ThreadPoolExecutor(max_workers=config.series_workers) as executor:
+            for series_warnings in executor.map(lambda url: crawl_series(url, config, **resources), config.urls):
+                warnings += series_warnings
+    else:
+        warnings = []
+        for url in config.urls:
+            warnings += crawl_series(url, config, **resources)
+    if resources is not None and resources["recompressor"] is not None:
+        resources["recompressor"].close()
+    if config.profile_directory is not None:
+        profiler.stop()
+        print_info("Profile: {} samples written to {}.".format(profiler.write(config.profile_directory),
+                                                              config.profile_directory))
+
+    if resources is not None and resources["cache"] is not None:
+        resources["cache"].flush()
+    if config.cache_directory is not None:
+        print_info("Cache: {} hits, {} misses.".format(metrics.total('cache_hits'), metrics.total('cache_misses')))
+
+    if config.store_directory is not None:
+        print_info("Image store: {} pages reused without downloading them ({:.1f} MB), {} downloaded pages already "
+                   "stored ({:.1f} MB), {} new images.".format(
+                       metrics.total('store_hits'), metrics.total('store_hit_bytes') / 1024 / 1024,
+                       metrics.total('store_duplicates'), metrics.total('store_duplicate_bytes') / 1024 / 1024,
+                       metrics.total('store_objects')))
+
+    if config.stats:
+        print('\nRun statistics:')
+        print(metrics.summary())
+    if config.metrics_file is not None:
+        metrics.write(config.metrics_file)
+
+    if len(warnings) > 0:
+        print('\nFollowing warnings were encountered during runtime:')
+        for warning in warnings:
+            print(warning)
+
+
+if __name__ == '__main__':
+    main()
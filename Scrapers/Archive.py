@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+from Scrapers.Metrics import metrics
+import io
+import threading
+import time
+import zipfile
+
+
+class MemoryBudget(object):
+    """Bytes that the pages downloaded ahead of their turn in a process may hold in memory at the same time.
+
+    A download reserves a block before reading it from the network and gives it back once its page has been taken,
+    so that when the budget is used up the downloads of pages ahead of their turn stall instead of memory growing."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size, timeout=None):
+        """Reserves size bytes, waiting up to timeout seconds for them. Returns whether they were reserved."""
+        with self._condition:
+            # A reservation larger than the whole budget is let through alone rather than never.
+            if not self._condition.wait_for(lambda: self.used == 0 or self.used + size <= self.limit, timeout):
+                return False
+            self.used += size
+            return True
+
+    def reserve(self, size, wanted):
+        """Reserves size bytes for as long as wanted() is true and returns the bytes reserved: size, or 0 once
+        wanted() is false. Waits in short steps so that a page that stops needing a reservation meanwhile (the
+        page its caller comes to) stops waiting."""
+        while wanted():
+            if self.acquire(size, timeout=0.05):
+                return size
+        return 0
+
+    def release(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class ArchiveWriter(object):
+    """Writes the pages of a chapter into a ZIP archive, streaming each one into its entry.
+
+    Pages are numbered from 1 and written in page order, those that are missing being left out.
+    entry_name(page, position, extension) returns the name of a page inside the archive, position being its 1-based
+    position among the pages actually written. entries maps the pages written to their entry names."""
+
+    # Formats that are already compressed and gain nothing from deflate.
+    stored_extensions = ('gif', 'jpeg', 'jpg', 'png', 'webp')
+    block_size = 64 * 1024
+
+    def __init__(self, filename, entry_name):
+        self.filename = filename
+        self.entry_name = entry_name
+        self.written = 0
+        self.entries = {}
+        self.write_time = 0.0
+        self._zip = zipfile.ZipFile(filename, mode='w')
+
+    def write(self, page, stream, extension):
+        """Adds a page read from a file-like object or bytes and returns its size"""
+        if not hasattr(stream, 'read'):
+            stream = io.BytesIO(stream)
+        name = self.entry_name(page, self.written + 1, extension)
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        if extension.lower() in self.stored_extensions:
+            info.compress_type = zipfile.ZIP_STORED
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+
+        size = 0
+        try:
+            with self._zip.open(info, mode='w') as entry:
+                for block in iter(lambda: stream.read(self.block_size), b''):
+                    self._write_block(entry, block)
+                    size += len(block)
+        except Exception:
+            self._discard(info)
+            raise
+        self.written += 1
+        self.entries[page] = name
+        metrics.count('pages')
+        return size
+
+    def close(self):
+        start = time.perf_counter()
+        self._zip.close()
+        self.write_time += time.perf_counter() - start
+        metrics.observe('archive_write_seconds', self.write_time)
+
+    def _write_block(self, entry, block):
+        # Only the time spent writing counts, not the time spent waiting for the network.
+        start = time.perf_counter()
+        entry.write(block)
+        self.write_time += time.perf_counter() - start
+
+    def _discard(self, info):
+        """Drops a partially written entry by cutting the archive back to where its header started"""
+        if getattr(info, 'header_offset', None) is None:
+            return
+        if info in self._zip.filelist:
+            self._zip.filelist.remove(info)
+            self._zip.NameToInfo.pop(info.filename, None)
+        self._zip.fp.seek(info.header_offset)
+        self._zip.fp.truncate()
+        self._zip.start_dir = info.header_offset
+
+
+# Budget shared by the page downloads of the running process, resized by Manager from --memory.
+memory = MemoryBudget(64 * 1024 * 1024)
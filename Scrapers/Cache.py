@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+from Scrapers.Lock import file_lock, replaced_file
+from Scrapers.Metrics import metrics
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class HttpCache(object):
+    """On-disk cache of response bodies keyed by URL, revalidated with the ETag and Last-Modified they came with.
+
+    The bodies are kept in files named after the SHA-1 of their URL, next to an index.json holding their validators,
+    size and last use. Once the bodies take more than max_size bytes the least recently used ones are evicted.
+    Several processes can share the directory: the index is re-read and merged with the entries of this process
+    under a file_lock on index.lock whenever it is written. Cache hits only update the last
+    use in memory, written with the next stored page, at most every save_interval seconds, or by flush()."""
+
+    save_interval = 30
+
+    def __init__(self, directory, max_size=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._index_path = os.path.join(directory, 'index.json')
+        self._lock_path = os.path.join(directory, 'index.lock')
+        self._lock = threading.Lock()
+        # Entries stored and last uses of hits since the index was last written.
+        self._stored = set()
+        self._accessed = {}
+        self._saved = time.time()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._index = self._load()
+
+    def validators(self, url):
+        """Returns the conditional request headers for a cached URL"""
+        with self._lock:
+            entry = self._index.get(self._key(url))
+        headers = {}
+        if entry is not None and os.path.exists(os.path.join(self.directory, self._key(url))):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def hit(self, url):
+        """Returns the cached body of a URL the server answered 304 Not Modified for, or None if it was evicted since
+        its validators were sent"""
+        key = self._key(url)
+        try:
+            with open(os.path.join(self.directory, key), 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+        metrics.count('cache_hits')
+        with self._lock:
+            self.hits += 1
+            self._accessed[key] = time.time()
+            if time.time() - self._saved >= self.save_interval:
+                self._save()
+        return body
+
+    def store(self, url, headers, body):
+        """Stores a freshly downloaded body if it came with validators to revalidate it later"""
+        metrics.count('cache_misses')
+        with self._lock:
+            self.misses += 1
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            return
+
+        key = self._key(url)
+        with open(os.path.join(self.directory, key), 'wb') as f:
+            f.write(body)
+        with self._lock:
+            self._index[key] = {"url": url, "etag": etag, "last_modified": last_modified, "size": len(body),
+                                "accessed": time.time()}
+            self._stored.add(key)
+            self._save()
+
+    def flush(self):
+        """Writes the last uses of the pages served from the cache since the index was last written"""
+        with self._lock:
+            if self._accessed:
+                self._save()
+
+    def _load(self):
+        try:
+            with open(self._index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self._index.values())
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]['accessed']):
+            if total <= self.max_size:
+                break
+            total -= entry['size']
+            del self._index[key]
+            try:
+                os.remove(os.path.join(self.directory, key))
+            except OSError:
+                pass
+
+    def _save(self):
+        """Merges the changes of this process into the index on disk, evicts past max_size and writes it"""
+        with file_lock(self._lock_path):
+            index = self._load()
+            index.update((key, self._index[key]) for key in self._stored if key in self._index)
+            for key, accessed in self._accessed.items():
+                if key in index:
+                    index[key]['accessed'] = max(index[key]['accessed'], accessed)
+            self._index = index
+            self._evict()
+            with replaced_file(self._index_path) as f:
+                json.dump(self._index, f)
+        self._stored.clear()
+        self._accessed.clear()
+        self._saved = time.time()
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
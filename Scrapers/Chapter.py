@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+from bisect import bisect_left
+
+
+class Record(object):
+    """Base of the classes whose fields can also be read like a dictionary, as the scrapers used to return them"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+
+class Chapter(Record):
+    """A chapter of a series. Fields can also be read like a dictionary: chapter["url"]."""
+
+    __slots__ = ('chapter', 'name', 'url', 'group')
+
+    def __init__(self, chapter, name, url, group=None):
+        self.chapter = chapter
+        self.name = name
+        self.url = url
+        self.group = group
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __repr__(self):
+        return 'Chapter({!r}, {!r}, {!r}, {!r})'.format(self.chapter, self.name, self.url, self.group)
+
+    @property
+    def label(self):
+        """Chapter number as written by the user with -s and -e, e.g. "12" or "12.5"."""
+        try:
+            return '{:g}'.format(self.chapter)
+        except ValueError:
+            return '{}'.format(self.chapter)
+
+
+class ChapterList(object):
+    """Chapters of a series in reading order, indexed by their label."""
+
+    def __init__(self, chapters):
+        self._chapters = list(chapters)
+        self._positions = {}
+        for position, chapter in enumerate(self._chapters):
+            self._positions.setdefault(chapter.label, []).append(position)
+
+    def __len__(self):
+        return len(self._chapters)
+
+    def __iter__(self):
+        return iter(self._chapters)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return ChapterList(self._chapters[item])
+        return self._chapters[item]
+
+    def find(self, label, start=0, stop=None):
+        """Returns the position of the first chapter labelled label within [start, stop), or None"""
+        positions = self._positions.get(label, ())
+        i = bisect_left(positions, start)
+        if i < len(positions) and (stop is None or positions[i] < stop):
+            return positions[i]
+        return None
+
+    def duplicates(self):
+        """Returns the releases of every chapter number that has more than one, in reading order"""
+        releases = {}
+        for chapter in self._chapters:
+            releases.setdefault(chapter.chapter, []).append(chapter)
+        return [group for group in releases.values() if len(group) > 1]
+
+    def without(self, chapters):
+        """Returns a new list without the given chapters"""
+        dropped = set(id(chapter) for chapter in chapters)
+        return ChapterList(chapter for chapter in self._chapters if id(chapter) not in dropped)
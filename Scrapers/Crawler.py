@@ -1,22 +1,94 @@
 #!/usr/bin/python
 
-from __main__ import print_info
 from abc import ABCMeta, abstractmethod
+from bs4 import BeautifulSoup
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from Scrapers.Archive import ArchiveWriter, memory
+from Scrapers.Metrics import metrics
+from Scrapers.Mirrors import Mirrors
+from Scrapers.Output import print_info
+from Scrapers.Page import Page, PageBody
+from Scrapers.Profile import profiler
+from Scrapers.Throttle import Throttle
+from Scrapers.Transport import download_errors, Transport
+import asyncio
+import collections
+import importlib.util
+import io
+import itertools
+import logging
 import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
 import zipfile
 
+# Only whether lxml is installed matters here: BeautifulSoup imports it when it parses with it.
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') is not None else 'html.parser'
+
 
 class Crawler(metaclass=ABCMeta):
+    # Cookies sent with every request to the domain of the site (the host of its URLs without www.).
+    cookies = {}
+    # BeautifulSoup tree builder, lxml when it is installed.
+    html_parser = HTML_PARSER
+    # Groups of image hosts that serve the same paths, tried in place of each other.
+    mirror_hosts = ()
+    # Fraction of image requests answered faster than one that is hedged, None to never hedge. Requests are only
+    # hedged to another mirror: not at all without mirror_hosts or a --server.
+    hedge_percentile = 0.95
+    # Bytes read from a page at a time while scanning it for a pattern.
+    scan_block_size = 16 * 1024
+    # Bytes read from an image at a time by page_stream.
+    image_block_size = 64 * 1024
+    # DownloadState of the download directory, used to resume archives that are missing pages.
+    state = None
+    # PartialDownloads of the download directory, used to continue images whose download was cut off.
+    parts = None
+    # Series metadata and chapters read from the series page, which is not kept once they are; None and empty when
+    # the URL is neither a series nor a chapter page.
+    series = None
+    chapters = ()
+    # Scheduler priority of the series and chapter pages, ahead of the images of every chapter.
+    page_priority = float('inf')
+
+    def __init__(self, url, page_workers=1, cache=None, throttle=None, store=None, recompressor=None, server=None,
+                 scheduler=None):
+        self.page_workers = max(1, int(page_workers))
+        self.cache = cache
+        self.store = store
+        self.recompressor = recompressor
+        self.mirrors = Mirrors(self.mirror_hosts, server,
+                               self.hedge_percentile if self.mirror_hosts or server is not None else None)
+        self._hedges = None
+        self._hedge_futures = set()
+        self._hedges_lock = threading.Lock()
+        if throttle is None:
+            throttle = Throttle(concurrency=self.page_workers)
+        self.transport = Transport(headers={'User-agent': self.default_user_agent()}, cookies=self.cookies,
+                                   pool_size=self.page_workers, throttle=throttle, scheduler=scheduler, series=url,
+                                   cookie_domain=re.sub(r'^www\.', '', urllib.parse.urlsplit(url).hostname or ''))
+
     @abstractmethod
-    def __init__(self, url):
+    def chapter_info(self, chapter_data):
         pass
 
     @abstractmethod
-    def chapter_info(self, chapter_data):
+    def chapter_pages(self, chapter):
+        """Returns the image URLs of a chapter, in reading order"""
         pass
 
     @abstractmethod
-    def download_chapter(self, chapter, download_directory, download_name):
+    def download_chapter(self, chapter, download_directory, download_name, image_urls=None, finish=None):
+        """Downloads a chapter into an archive and returns its warnings. image_urls are those of chapter_pages when
+        they are already known; finish is passed on to download_pages."""
+        pass
+
+    @abstractmethod
+    def entry_name(self, chapter):
+        """Returns the entry_name function naming the pages of a chapter in its archive (see ArchiveWriter)"""
         pass
 
     @abstractmethod
@@ -24,18 +96,453 @@ class Crawler(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def series_info(self, search):
+    def series_metadata(self, page):
+        """Returns the Series read from a parsed series page"""
         pass
 
+    def series_info(self, search):
+        """Returns a field of the series metadata: title, author, artist or description"""
+        return self.series[search]
+
+    def verify_archive(self, chapter, image_urls, filename):
+        """Checks the archive of a chapter against its image_urls by the names of its entries, reading only the central
+        directory of the archive, and returns the pages missing from it. Pages are matched through the download
+        state when it knows the archive, and otherwise by the names entry_name would give them with no page missing.
+        When entry_name numbers the entries by position, an archive without state that lacks some of them cannot
+        tell which pages those are, and all its pages are reported missing.
+        An archive missing pages is recorded as such in the download state, so that downloading the chapter again
+        only fetches those pages."""
+        name = os.path.basename(filename)
+        try:
+            with zipfile.ZipFile(filename) as archive:
+                names = set(archive.namelist())
+        except (OSError, zipfile.BadZipFile):
+            names = set()
+        record = self.state.chapter(name)
+        if record is not None and record['pages'] == len(image_urls):
+            entries = {int(page): entry for page, entry in record['entries'].items() if entry in names}
+        else:
+            entry_name = self.entry_name(chapter)
+            stems = {os.path.splitext(entry)[0]: entry for entry in names}
+            entries = {}
+            for page, image_url in enumerate(image_urls, start=1):
+                stem = os.path.splitext(entry_name(page, page, self.file_extension(image_url)))[0]
+                if stem in stems:
+                    entries[page] = stems[stem]
+            # Names by position leave no gap where a page is missing, so the pages after it take its names.
+            if len(entries) < len(image_urls) and entry_name(1, 1, 'jpg') != entry_name(1, 2, 'jpg'):
+                entries = {}
+        missing = [page for page in range(1, len(image_urls) + 1) if page not in entries]
+
+        metrics.count('archives_verified')
+        if missing:
+            metrics.count('archives_incomplete')
+            metrics.count('pages_missing', len(missing))
+        if record is None or record['pages'] != len(image_urls) or missing != record['missing'] or \
+                len(entries) != len(record['entries']):
+            self.state.update(name, chapter, len(image_urls), entries, missing, checksum=False)
+        return missing
+
+    async def chapter_stream(self):
+        """Yields the chapters of the series, as series_chapters() lists them"""
+        for chapter in self.series_chapters():
+            yield chapter
+
+    async def page_stream(self, chapter, image_urls=None, pages=None, window=None, stream=False):
+        """Yields a Page for each image of a chapter in reading order, as soon as it and those before it are
+        downloaded. Up to window images (page_workers by default) are downloaded at a time, ahead of the page the
+        caller is at, so that a slow caller holds the downloads back instead of filling the memory. The images
+        ahead of the page the caller waits for are read within the MemoryBudget memory (--memory), which they hold
+        until the caller asks for the page after theirs.
+        With stream, a Page has a body to read in place of its bytes, valid until the caller asks for the next
+        page: the page the caller waits for is then read from the network as the body is read, instead of being
+        held in memory.
+        image_urls are those of chapter_pages, looked up when not given; pages are the numbers of the pages to
+        download, all of them by default. A page that fails is yielded with its error. The images are requested
+        with the chapter_priority of the chapter. A caller that stops before the last page closes the stream with
+        aclose(), so that the downloads ahead of it give their memory back."""
+        loop = asyncio.get_event_loop()
+        priority = self.chapter_priority(chapter)
+        if image_urls is None:
+            image_urls = await loop.run_in_executor(None, self.chapter_pages, chapter)
+        if pages is None:
+            pages = range(1, len(image_urls) + 1)
+        pages = iter(pages)
+        window = max(1, window or self.page_workers)
+        executor = ThreadPoolExecutor(max_workers=window)
+        pending = collections.deque()
+        # The page the caller waits for, 0 once the stream is closed: neither is read ahead into memory.
+        waited = [None]
+        try:
+            while True:
+                for page in itertools.islice(pages, window - len(pending)):
+                    future = executor.submit(self.download_page, image_urls[page - 1], priority,
+                                             lambda page=page: waited[0] not in (page, 0))
+                    pending.append((page, future))
+                if not pending:
+                    return
+                page, future = pending[0]
+                waited[0] = page
+                image_url = image_urls[page - 1]
+                try:
+                    body, size, extension, reserved = await asyncio.wrap_future(future)
+                except download_errors as e:
+                    pending.popleft()
+                    yield Page(page, image_url, self.file_extension(image_url), error=e)
+                    continue
+                pending.popleft()
+                try:
+                    if stream:
+                        result = Page(page, image_url, extension, size=size, body=body)
+                    else:
+                        try:
+                            data = await loop.run_in_executor(executor, body.read)
+                        except download_errors as e:
+                            result = Page(page, image_url, extension, error=e)
+                        else:
+                            result = Page(page, image_url, extension, data, len(data) if size is None else size)
+                    yield result
+                finally:
+                    body.close()
+                    memory.release(reserved)
+        finally:
+            waited[0] = 0
+            for _, future in pending:
+                future.cancel()
+                future.add_done_callback(release_page)
+            executor.shutdown(wait=False)
+
+    def download_page(self, image_url, priority=0, ahead=lambda: False):
+        """Returns the (PageBody, size downloaded, extension, bytes reserved) of a page opened with open_image. While
+        ahead() is true, the image is read into memory, each block being reserved from the MemoryBudget memory before
+        it is read; once it is false, the rest of the image is left to the body, which reads it from the network.
+        With a Recompressor the whole image is read and the body holds it recompressed. size is None when the image
+        was not read whole. The caller closes the body and releases the bytes reserved once it is done with the
+        page."""
+        reserved = 0
+        image = None
+        try:
+            with profiler.phase('image_fetch'):
+                image = self.open_image(image_url, priority)
+                # Read into a single buffer, whose bytes getvalue hands over without copying them again.
+                buffer = io.BytesIO()
+                while self.recompressor is not None or ahead():
+                    reserved += memory.reserve(self.image_block_size, ahead)
+                    block = image.read(self.image_block_size)
+                    if not block:
+                        image.close()
+                        image = None
+                        break
+                    buffer.write(block)
+            extension = self.file_extension(image_url)
+            if image is not None:
+                return PageBody(buffer.getvalue(), image), None, extension, reserved
+            data = buffer.getvalue()
+            if self.recompressor is None:
+                return PageBody(data), len(data), extension, reserved
+            recompressed, extension = self.recompressor.recompress(data, extension)
+            return PageBody(recompressed), len(data), extension, reserved
+        except BaseException:
+            if image is not None:
+                image.close()
+            memory.release(reserved)
+            raise
+
+    def open_image(self, image_url, priority=0):
+        """Returns a file-like object reading an image, requested with the scheduler priority, which the caller
+        closes. With an ImageStore, an image whose URL was fetched before is read from the store and the others are
+        added to it while they are read; with PartialDownloads, a download that was cut off is continued, and its
+        .part file is kept when the request fails for any reason but the range being refused.
+        Raises one of download_errors."""
+        digest = self.store.lookup(image_url) if self.store is not None else None
+        if digest is not None:
+            return self.store.open(digest)
+        headers = self.parts.headers(image_url) if self.parts is not None else None
+        try:
+            response = self.request_image(image_url, headers, priority)
+            if self.parts is not None:
+                response = self.parts.open(image_url, response, self.transport, priority)
+        except download_errors as e:
+            # 416 Range Not Satisfiable: the image is no longer the one the .part file holds the start of.
+            if headers is not None and isinstance(e, urllib.error.HTTPError) and e.code == 416:
+                self.parts.discard(image_url)
+            raise
+        if self.store is not None:
+            response = self.store.intake(image_url, response)
+        return response
+
+    def download_pages(self, chapter, image_urls, filename, entry_name, finish=None):
+        """Downloads the images through page_stream and writes them into the archive filename in page order, naming
+        the entries with entry_name (see ArchiveWriter).
+        If the download state knows the archive from an earlier run that missed some pages, only those pages are
+        fetched and the others are copied over from the existing archive.
+        Yields the error of each image that failed (one of download_errors), or None, in the same order as
+        image_urls. Once they are all downloaded, the archive is closed, renamed and recorded in the download state
+        right away, or handed as a function to finish, which can run it while the next chapter downloads.
+        Raises ValueError when image_urls is empty, rather than recording an empty archive as complete."""
+        if not image_urls:
+            raise ValueError('No pages found in {}'.format(chapter["url"]))
+        name = os.path.basename(filename)
+        present = {}
+        if self.state is not None:
+            record = self.state.chapter(name)
+            if record is not None and record['missing'] and record['pages'] == len(image_urls):
+                present = {int(page): entry for page, entry in record['entries'].items()}
+        if present:
+            print_info("Resuming download: {} of {} pages already downloaded.".format(len(present), len(image_urls)))
+            previous = zipfile.ZipFile(filename)
+
+        archive = ArchiveWriter(filename + '.tmp', entry_name)
+        missing = []
+        sizes = {}
+        # The stream is driven one page at a time, so that each error is yielded as soon as its page is done.
+        loop = asyncio.new_event_loop()
+        pages = self.page_stream(chapter, image_urls, [page for page in range(1, len(image_urls) + 1)
+                                                       if page not in present], stream=True)
+        try:
+            for page in range(1, len(image_urls) + 1):
+                if page in present:
+                    with previous.open(present[page]) as entry:
+                        archive.write(page, entry, os.path.splitext(present[page])[1][1:])
+                    yield None
+                    continue
+                result = loop.run_until_complete(pages.__anext__())
+                if result.error is None:
+                    # The page is read into its entry straight from the network.
+                    try:
+                        written = archive.write(page, result.body, result.extension)
+                    except download_errors as e:
+                        result.error = e
+                if result.error is not None:
+                    missing.append(page)
+                    metrics.count('pages_failed')
+                    yield result.error
+                    continue
+                if self.recompressor is not None:
+                    sizes[page] = (result.size, written)
+                yield None
+        except BaseException:
+            archive.close()
+            os.remove(archive.filename)
+            raise
+        finally:
+            loop.run_until_complete(pages.aclose())
+            loop.close()
+            if present:
+                previous.close()
+
+        def finish_archive():
+            try:
+                with profiler.phase('archive'):
+                    archive.close()
+                    os.replace(archive.filename, filename)
+            except BaseException:
+                if os.path.exists(archive.filename):
+                    os.remove(archive.filename)
+                raise
+            metrics.count('chapters')
+            if self.state is not None:
+                self.state.update(name, chapter, len(image_urls), archive.entries, missing)
+            print_info("Zip created: " + filename.replace(os.environ['HOME'], "~"))
+            if sizes:
+                before, after = sum(size[0] for size in sizes.values()), sum(size[1] for size in sizes.values())
+                print_info("Recompression: {} pages, {:.1f} MB to {:.1f} MB ({:.0%} saved).".format(
+                    len(sizes), before / 1024 / 1024, after / 1024 / 1024, 1 - after / before if before else 0))
+
+        if finish is None:
+            finish_archive()
+        else:
+            finish(finish_archive)
+
     @staticmethod
-    def zip_files(files, filename):
-        zipf = zipfile.ZipFile(filename, mode="w")
-        for f in files:
-            zipf.write(f, os.path.basename(f))
-            os.remove(f)
-        print_info("Zip created: " + filename.replace(os.environ['HOME'], "~"))
+    def file_extension(url):
+        return re.search(r'.*\.([A-Za-z]*)', url).group(1)
+
+    @staticmethod
+    def chapter_priority(chapter):
+        """Returns the scheduler priority of the images of a chapter: its number, so that the newest chapters are
+        downloaded first"""
+        try:
+            return float(chapter["chapter"])
+        except (KeyError, TypeError, ValueError):
+            return 0.0
+
+    def request_image(self, image_url, headers=None, priority=0):
+        """Requests an image from the fastest of its mirrors. When no response has come within the hedge delay, the
+        request is hedged: the next mirror is asked as well, the first response is kept and the other one closed as
+        soon as it arrives. A mirror that fails is followed by the next. An image with no mirror is never hedged, as
+        asking its host twice would only add to its load, and no request is hedged while the scheduler has requests
+        waiting for a connection. headers are sent with every request."""
+        urls = self.mirrors.urls(image_url)
+        delay = self.mirrors.delay()
+        if delay is None or len(urls) < 2:
+            return self._request_mirror(urls[0], headers, priority=priority)
+        with self._hedges_lock:
+            if self._hedges is None:
+                self._hedges = ThreadPoolExecutor(max_workers=4 * self.page_workers)
+
+        pending = {self._submit_hedge(urls[0], headers, False, priority)}
+        hedge = None
+        error = None
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=delay if hedge is None else None, return_when=FIRST_COMPLETED)
+                responses = []
+                for future in done:
+                    try:
+                        responses.append((future, future.result()))
+                    except download_errors as e:
+                        error = e
+                if responses:
+                    for _, response in responses[1:]:
+                        response.close()
+                    if responses[0][0] is hedge:
+                        metrics.count('hedge_wins')
+                    return responses[0][1]
+                if hedge is None:
+                    if not done:
+                        if self.transport.scheduler is not None and self.transport.scheduler.depth:
+                            # Requests are waiting for a connection: this one may be too, and a hedge would only
+                            # queue behind them.
+                            continue
+                        metrics.count('hedged_requests')
+                    hedge = self._submit_hedge(urls[1], headers, not done, priority)
+                    pending.add(hedge)
+            raise error
+        finally:
+            for future in pending:
+                future.add_done_callback(discard)
+
+    def _submit_hedge(self, url, headers, hedge, priority):
+        """Runs _request_mirror in the hedge threads, keeping its future until it is done so that close can cancel
+        it"""
+        future = self._hedges.submit(self._request_mirror, url, headers, hedge, priority)
+        with self._hedges_lock:
+            self._hedge_futures.add(future)
+        future.add_done_callback(self._forget_hedge)
+        return future
+
+    def _forget_hedge(self, future):
+        with self._hedges_lock:
+            self._hedge_futures.discard(future)
+
+    def _request_mirror(self, url, headers=None, hedge=False, priority=0):
+        start = time.monotonic()
+        try:
+            response = self.transport.request(url, headers, hedge, priority)
+        except download_errors:
+            self.mirrors.failed(url)
+            raise
+        # The time spent waiting for a connection of the scheduler says nothing about the mirror.
+        self.mirrors.observe(url, time.monotonic() - start - response.waited)
+        return response
+
+    def open_url(self, url):
+        """Opens the URL through the shared transport and returns the response as a decompressed stream.
+        With an HttpCache the page is revalidated and served from the cache when the server reports it unchanged."""
+        logging.debug('Opening URL: %s', url)
+        if self.cache is None:
+            return self.transport.request(url, priority=self.page_priority)
+
+        response = self.transport.request(url, headers=self.cache.validators(url), priority=self.page_priority)
+        if response.status == 304:
+            with response:
+                response.read()
+            logging.debug('Not modified: %s', url)
+            body = self.cache.hit(url)
+            if body is not None:
+                return io.BytesIO(body)
+            # Evicted by another process meanwhile.
+            response = self.transport.request(url, priority=self.page_priority)
+        with response:
+            body = response.read()
+        self.cache.store(url, response.headers, body)
+        return io.BytesIO(body)
+
+    def parse(self, url, page_type, parse_only=None):
+        """Downloads and parses a page, recording the parse time as parse_<page_type>_seconds"""
+        with self.open_url(url) as response:
+            html = response.read()
+        return self.soup(html, page_type, parse_only)
+
+    def soup(self, html, page_type, parse_only=None):
+        """Parses a downloaded page, recording the parse time as parse_<page_type>_seconds"""
+        with metrics.timer('parse_{}_seconds'.format(page_type)):
+            return BeautifulSoup(html, self.html_parser, parse_only=parse_only)
+
+    def scan(self, url, page_type, pattern, start):
+        """Reads a page only until the compiled bytes pattern matches in it and returns (match, None), leaving the
+        rest of the page unread. If the pattern is not in the page, returns (None, html) with the whole page so that
+        the caller can parse it instead. The time spent matching is recorded as scan_<page_type>_seconds.
+        start is the bytes every match of pattern begins with: only the bytes just read are searched for it, and
+        pattern is only tried from where it first occurs, so that a long page is not searched again for every
+        block."""
+        response = self.open_url(url)
+        html = bytearray()
+        begin = None
+        elapsed = 0.0
+        try:
+            while True:
+                block = response.read(self.scan_block_size)
+                if not block:
+                    return None, bytes(html)
+                html += block
+                timer = time.perf_counter()
+                if begin is None:
+                    # start may have been cut in two by the previous block.
+                    position = html.find(start, max(0, len(html) - len(block) - len(start) + 1))
+                    begin = position if position >= 0 else None
+                match = pattern.search(html, begin) if begin is not None else None
+                elapsed += time.perf_counter() - timer
+                if match:
+                    return match, None
+        finally:
+            response.close()
+            metrics.observe('scan_{}_seconds'.format(page_type), elapsed)
+
+    def page_warning(self, image_name, chapter):
+        """Returns the warning message for a page that could not be downloaded"""
+        try:
+            return 'Download of page {}, chapter {:g}, series "{}" failed.'.format(image_name, chapter["chapter"],
+                                                                                   self.series_info('title'))
+        except ValueError:
+            return 'Download of page {}, chapter {}, series "{}" failed.'.format(image_name, chapter["chapter"],
+                                                                                 self.series_info('title'))
 
     def default_user_agent(self):
         """Get default user agent to whole project"""
         return 'Mozilla/5.0 (Windows NT 6.2; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)' \
                ' Chrome/32.0.1667.0 Safari/537.36'
+
+    def close(self):
+        """Stops the threads of hedged requests, once those still running are done, and closes the idle
+        connections"""
+        with self._hedges_lock:
+            hedges, self._hedges = self._hedges, None
+            futures = list(self._hedge_futures)
+        # The requests that have not started are cancelled by hand: shutdown only does it from Python 3.9 on.
+        for future in futures:
+            future.cancel()
+        if hedges is not None:
+            hedges.shutdown(wait=False)
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def release_page(future):
+    """Closes the body of a download_page of page_stream that the caller never took and gives back its memory"""
+    if not future.cancelled() and future.exception() is None:
+        body, _, _, reserved = future.result()
+        body.close()
+        memory.release(reserved)
+
+
+def discard(future):
+    """Closes the response of a request that lost to its hedge"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
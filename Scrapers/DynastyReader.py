@@ -1,54 +1,68 @@
 # /usr/bin/python
 
-from __main__ import print_info
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
+from Scrapers.Chapter import Chapter
 from Scrapers.Crawler import Crawler
-import gzip
-import io
+from Scrapers.Metrics import metrics
+from Scrapers.Output import print_info
+from Scrapers.Profile import profiler
+from Scrapers.Series import Series
 import logging
 import re
-import urllib.request, urllib.error, urllib.parse
+
+
+CHAPTER_NAME = re.compile(r'Chapter\s.*:\s(.*)')
+CHAPTER_NUMBER = re.compile(r'Chapter (.*?)(:|$)')
+SERIES_LINK = re.compile(r'/series/')
+# The image list of a chapter page, as a script variable.
+PAGES = re.compile(rb'var pages\s*=\s*\[(.*?)\];', re.S)
+IMAGE = re.compile(r'"image":"(.*?)"')
 
 
 class DynastyReader(Crawler):
     site_name = 'Dynasty Reader'
     uses_groups = False
 
-    def __init__(self, url):
-        super(DynastyReader, self).__init__(url)
+    def __init__(self, url, **kwargs):
+        super(DynastyReader, self).__init__(url, **kwargs)
         self.url = url
         if re.match(r'.*dynasty-scans\.com/series/.*', url):
-            self.page = BeautifulSoup(self.open_url(url), "html.parser")
+            page = self.parse(url, 'series')
             self.init_with_chapter = False
             logging.debug('Object initialized with series')
         elif re.match(r'.*dynasty-scans\.com/chapters/.*', url):
-            self.page = BeautifulSoup(self.open_url(self.chapter_series(url)), "html.parser")
+            page = self.parse(self.chapter_series(url), 'series')
             self.init_with_chapter = True
             logging.debug('Object initialized with chapter')
         else:
-            self.page = None
+            page = None
             self.init_with_chapter = False
             logging.debug('Empty object initialized')
-        logging.debug('Object created with ' + url)
+        if page is not None:
+            self.series = self.series_metadata(page)
+            with metrics.timer('parse_chapter_list_seconds'), profiler.phase('chapter_list'):
+                self.chapters = [self.chapter_info(chapter) for chapter in
+                                 page.find("dl", class_="chapter-list").find_all("dd")]
+        logging.debug('Object created with %s', url)
 
     # Returns the series page for an individual chapter URL
     # Useful for scraping series metadata for an individual chapter.
     def chapter_series(self, url):
         logging.debug('Fetching series URL')
-        chapter = BeautifulSoup(self.open_url(url), "html.parser")
-        series_url = 'http://dynasty-scans.com/' + chapter.find('a', href=re.compile(r'/series/'))['href']
-        logging.debug('Series URL: ' + series_url)
+        chapter = self.parse(url, 'chapter', SoupStrainer('a', href=SERIES_LINK))
+        series_url = 'http://dynasty-scans.com/' + chapter.find('a', href=SERIES_LINK)['href']
+        logging.debug('Series URL: %s', series_url)
         return series_url
 
-    # Returns a dictionary containing chapter number, chapter name and chapter URL.
+    # Returns a Chapter with the chapter number, chapter name and chapter URL.
     def chapter_info(self, chapter_data):
-        logging.debug('Fetching chapter info')
-        chapter = BeautifulSoup(str(chapter_data), "html.parser")
-        chapter_url = 'http://dynasty-scans.com' + chapter.a['href']
+        link = chapter_data.a
+        text = link.text
+        chapter_url = 'http://dynasty-scans.com' + link['href']
         try:
-            chapter_number = re.search(r'Chapter (.*?)(:|$)', chapter.a.text).group(1)
+            chapter_number = CHAPTER_NUMBER.search(text).group(1)
         except:
-            chapter_number = chapter.a.text
+            chapter_number = text
 
         try:
             chapter_number = float(chapter_number)
@@ -56,110 +70,69 @@ class DynastyReader(Crawler):
             pass
 
         try:
-            chapter_name = re.search(r'Chapter\s.*:\s(.*)', chapter.a.text).group(1)
+            chapter_name = CHAPTER_NAME.search(text).group(1)
         except AttributeError:
             chapter_name = None
 
-        logging.debug('Chapter number: {}'.format(chapter_number))
-        logging.debug('Chapter name: ' + str(chapter_name))
-        logging.debug('Chapter URL: ' + chapter_url)
+        logging.debug('Chapter %s: %s (%s)', chapter_number, chapter_name, chapter_url)
 
-        return {"chapter": chapter_number, "name": chapter_name, "url": chapter_url}
+        return Chapter(chapter_number, chapter_name, chapter_url)
 
-    def download_chapter(self, chapter, download_directory, download_name):
-        files = []
-        warnings = []
+    def chapter_pages(self, chapter):
+        match, html = self.scan(chapter["url"], 'chapter', PAGES, b'var pages')
+        if match is not None:
+            return ['http://dynasty-scans.com/' + image for image in IMAGE.findall(match.group(1).decode('utf-8'))]
 
-        logging.debug('Downloading chapter {}.'.format(chapter["url"]))
-        page = BeautifulSoup(self.open_url(chapter["url"]), "html.parser")
+        # The page layout changed: look for the list in the scripts of the parsed page.
+        logging.debug('Image list not found by scanning %s', chapter["url"])
+        metrics.count('scan_fallbacks')
+        image_urls = []
+        page = self.soup(html, 'chapter', SoupStrainer('script'))
         scripts = page.find_all("script")
         for script in scripts:
-            if re.search(r'var pages', script.text):
-                matches = re.findall(r'"image":"(.*?)"', script.text)
-                image_count = len(matches)
-                for image_name, match in enumerate(matches, start=1):
-                    print_info("Download: Page {0:04d} / {1:04d}".format(image_name, image_count))
-                    image_url = 'http://dynasty-scans.com/' + match
-                    file_extension = re.search(r'.*\.([A-Za-z]*)', image_url).group(1)
-                    req = urllib.request.Request(image_url, headers={
-                        'User-agent': self.default_user_agent(),
-                        'Accept-encoding': 'gzip'})
-
-                    try:
-                        response = urllib.request.urlopen(req)
-                    except urllib.error.HTTPError as e:
-                        print_info('WARNING: Unable to download file ({}).'.format(str(e)))
-                        warnings.append('Download of page {}, chapter {:g}, series "{}" failed.'.format(image_name,
-                                                                                                        chapter[
-                                                                                                            "chapter"],
-                                                                                                        self.series_info(
-                                                                                                            'title')))
-                        continue
-
-                    filename = '{}/{:06d}.{}'.format(download_directory, image_name, file_extension)
-                    f = open(filename, 'wb')
-                    f.write(response.read())
-                    f.close()
-                    files.append(filename)
+            if 'var pages' in script.text:
+                image_urls = ['http://dynasty-scans.com/' + image for image in IMAGE.findall(script.text)]
                 break
+        return image_urls
+
+    def download_chapter(self, chapter, download_directory, download_name, image_urls=None, finish=None):
+        warnings = []
+
+        logging.debug('Downloading chapter %s.', chapter["url"])
+        if image_urls is None:
+            image_urls = self.chapter_pages(chapter)
 
+        image_count = len(image_urls)
         filename = download_directory + '/' + download_name
-        self.zip_files(files, filename)
+        pages = self.download_pages(chapter, image_urls, filename, self.entry_name(chapter), finish)
+        for image_name, error in enumerate(pages, start=1):
+            print_info("Download: Page {0:04d} / {1:04d}".format(image_name, image_count))
+            if error is not None:
+                print_info('WARNING: Unable to download file ({}).'.format(str(error)))
+                warnings.append(self.page_warning(image_name, chapter))
 
         return warnings
 
-    # Function designed to create a request object with correct headers, open the URL and decompress it if it's gzipped.
-    def open_url(self, url):
-        logging.debug(url)
-        headers = {
-            'User-agent': self.default_user_agent(),
-            'Accept-encoding': 'gzip'}
-        req = urllib.request.Request(url, headers=headers)
-        response = urllib.request.urlopen(req)
-
-        if response.info().get('Content-Encoding') == 'gzip':
-            buf = io.BytesIO(response.read())
-            data = gzip.GzipFile(fileobj=buf, mode="rb")
-            return data
-        else:
-            return response.read()
+    def entry_name(self, chapter):
+        return lambda page, position, extension: '{:06d}.{}'.format(page, extension)
 
     def series_chapters(self, all_chapters=False):
         logging.debug('Fetching series chapters')
-        chapter_row = self.page.find("dl", class_="chapter-list").find_all("dd")
-        chapters = []
-        for chapter in chapter_row:
-            chapters.append(self.chapter_info(chapter))
-
         # If the object was initialized with a chapter, only return the chapters.
         if self.init_with_chapter:
             logging.debug('Searching for specified chapter')
-            for chapter in chapters:
+            for chapter in self.chapters:
                 if re.match(self.url, chapter["url"]):
-                    logging.debug('Chapter found: ' + str(chapter))
+                    logging.debug('Chapter found: %s', chapter)
                     return [chapter]
 
-        return sorted(chapters, key=lambda k: (type(k['chapter']) is str, k['chapter']), reverse=True)
-
-    def series_info(self, search):
-        def title():
-            return self.page.find("h2", class_="tag-title").b.text.strip()
-
-        def description():
-            try:
-                return self.page.find("div", class_="description").text
-            except:
-                return None
-
-        def author():
-            urls = self.page.find("h2", class_="tag-title").find_all('a', href=re.compile('authors'))
-            author = ''
-            for url in urls:
-                if author == '':
-                    author = url.text
-                else:
-                    author += ', ' + url.text
-            return author
-
-        options = {"title": title, "description": description, "author": author, "artist": author}
-        return options[search]()
+        return sorted(self.chapters, key=lambda k: (type(k['chapter']) is str, k['chapter']), reverse=True)
+
+    def series_metadata(self, page):
+        heading = page.find("h2", class_="tag-title")
+        try:
+            description = page.find("div", class_="description").text
+        except AttributeError:
+            description = None
+        author = ', '.join(url.text for url in heading.find_all('a', href=re.compile('authors')))
+        return Series(heading.b.text.strip(), author, author, description)
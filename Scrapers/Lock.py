@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+from contextlib import contextmanager
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """Holds an exclusive lock on the file path across the processes that share its directory, where fcntl is
+    available. The file is made for the lock and removed before it is released, so that it is not left next to the
+    files it guards; a process that locked a file removed meanwhile tries again on the new one."""
+    if fcntl is None:
+        yield
+        return
+    while True:
+        lock = open(path, 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino
+            except OSError:
+                current = False
+        except BaseException:
+            lock.close()
+            raise
+        if current:
+            break
+        lock.close()
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        lock.close()
+
+
+@contextmanager
+def replaced_file(path, mode='w'):
+    """Opens a temporary file next to path for writing, which replaces path once it is written and closed, so that
+    the processes that read path never see it half written. The temporary file is removed if writing it fails."""
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temporary, mode) as f:
+            yield f
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
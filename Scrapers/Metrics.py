@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+
+class Metrics(object):
+    """Counters and histograms collected while crawling.
+
+    Every metric has a name and an optional host it applies to. Histograms keep their samples, so percentiles are
+    exact; a run records a handful of samples per page, which is little next to the pages themselves. A process that
+    runs for days sets window, the number of most recent samples each histogram keeps: its percentiles are then those
+    of the window, while its count and sum still cover every sample."""
+
+    def __init__(self, window=None):
+        self.started = time.time()
+        self.window = window
+        self.counters = {}
+        self.samples = {}
+        # Count and sum of the samples of every histogram, including those dropped from its window.
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, host=None):
+        with self._lock:
+            self.counters[(name, host)] = self.counters.get((name, host), 0) + value
+
+    def observe(self, name, value, host=None):
+        with self._lock:
+            samples = self.samples.setdefault((name, host), [])
+            samples.append(value)
+            totals = self.totals.setdefault((name, host), [0, 0])
+            totals[0] += 1
+            totals[1] += value
+            # Trimmed once the window is twice full, so that dropping samples costs O(1) per sample.
+            if self.window is not None and len(samples) >= 2 * self.window:
+                del samples[:-self.window]
+
+    @contextmanager
+    def timer(self, name, host=None):
+        """Observes the seconds spent in the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, host)
+
+    def drain(self):
+        """Returns the (counters, samples) recorded so far and starts over, to hand them to another process"""
+        with self._lock:
+            counters, samples = self.counters, self.samples
+            self.counters, self.samples, self.totals = {}, {}, {}
+        return counters, samples
+
+    def merge(self, counters, samples):
+        """Adds the counters and samples drained from another Metrics"""
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, values in samples.items():
+                self.samples.setdefault(key, []).extend(values)
+                totals = self.totals.setdefault(key, [0, 0])
+                totals[0] += len(values)
+                totals[1] += sum(values)
+
+    def total(self, name):
+        """Returns the sum of a counter over all hosts"""
+        with self._lock:
+            return sum(value for (key, host), value in self.counters.items() if key == name)
+
+    def snapshot(self):
+        """Returns the metrics as a JSON serializable dictionary"""
+        elapsed = time.time() - self.started
+        with self._lock:
+            counters = [{"name": name, "host": host, "value": value}
+                        for (name, host), value in sorted(self.counters.items(), key=sort_key)]
+            histograms = [dict(name=name, host=host, **summarize(samples[-self.window:] if self.window else samples,
+                                                                 *self.totals[(name, host)]))
+                          for (name, host), samples in sorted(self.samples.items(), key=sort_key)]
+        rates = {}
+        for name in ('chapters', 'pages', 'bytes'):
+            rates[name + '_per_second'] = self.total(name) / elapsed if elapsed > 0 else 0.0
+        return {"elapsed": elapsed, "counters": counters, "histograms": histograms, "rates": rates}
+
+    def summary(self):
+        """Returns a human readable summary of the metrics"""
+        snapshot = self.snapshot()
+        lines = ['Run time: {:.1f}s'.format(snapshot["elapsed"])]
+        for counter in snapshot["counters"]:
+            lines.append('{}{}: {}'.format(counter["name"], label(counter["host"]), counter["value"]))
+        for histogram in snapshot["histograms"]:
+            lines.append('{}{}: n={} mean={:.3f} p50={:.3f} p90={:.3f} p99={:.3f} max={:.3f}'.format(
+                histogram["name"], label(histogram["host"]), histogram["count"], histogram["mean"], histogram["p50"],
+                histogram["p90"], histogram["p99"], histogram["max"]))
+        for name, value in sorted(snapshot["rates"].items()):
+            lines.append('{}: {:.2f}'.format(name, value))
+        return '\n'.join(lines)
+
+    def write(self, filename):
+        """Writes the metrics to filename, as a Prometheus textfile if it ends with .prom and as JSON otherwise"""
+        snapshot = self.snapshot()
+        with open(filename, 'w') as f:
+            if filename.endswith('.prom'):
+                f.write(prometheus(snapshot))
+            else:
+                json.dump(snapshot, f, indent=2)
+
+
+def sort_key(item):
+    (name, host), _ = item
+    return name, host or ''
+
+
+def label(host):
+    return ' ({})'.format(host) if host is not None else ''
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples, count=None, total=None):
+    """Returns the statistics of samples, with count and total as the number and sum of all samples when only the
+    most recent ones are kept"""
+    ordered = sorted(samples)
+    if count is None:
+        count, total = len(ordered), sum(ordered)
+    return {"count": count, "sum": total, "mean": total / count, "min": ordered[0],
+            "max": ordered[-1], "p50": percentile(ordered, 0.5), "p90": percentile(ordered, 0.9),
+            "p99": percentile(ordered, 0.99)}
+
+
+def prometheus(snapshot):
+    """Formats a snapshot in the Prometheus text exposition format"""
+    def labels(entry, extra=''):
+        pairs = []
+        if entry["host"] is not None:
+            pairs.append('host="{}"'.format(entry["host"]))
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    lines = []
+    for counter in snapshot["counters"]:
+        lines.append('mangacrawler_{}_total{} {}'.format(counter["name"], labels(counter), counter["value"]))
+    for histogram in snapshot["histograms"]:
+        name = 'mangacrawler_' + histogram["name"]
+        for quantile in ('0.5', '0.9', '0.99'):
+            lines.append('{}{} {}'.format(name, labels(histogram, 'quantile="{}"'.format(quantile)),
+                                          histogram["p" + quantile[2:].ljust(2, '0')]))
+        lines.append('{}_sum{} {}'.format(name, labels(histogram), histogram["sum"]))
+        lines.append('{}_count{} {}'.format(name, labels(histogram), histogram["count"]))
+    for name, value in sorted(snapshot["rates"].items()):
+        lines.append('mangacrawler_{} {}'.format(name, value))
+    lines.append('mangacrawler_elapsed_seconds {}'.format(snapshot["elapsed"]))
+    return '\n'.join(lines) + '\n'
+
+
+# Metrics of the running process, recorded by the transport, the scrapers and the archive writer.
+metrics = Metrics()
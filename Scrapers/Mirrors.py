@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+from collections import deque
+from Scrapers.Metrics import metrics, percentile
+import threading
+import urllib.parse
+
+
+class Mirrors(object):
+    """Mirrors of the hosts that serve images and how fast each of them answers.
+
+    hosts is a list of groups of host names that serve the same paths, and server a host name that serves the paths
+    of every host. The mirrors of an image are ranked by their smoothed response time, those not tried yet first, so
+    that a slow host is asked less. The hedge delay is the percentile (a fraction) of the last window response
+    times: a request still waiting for its response after it is among the slowest and worth asking again."""
+
+    # Response times remembered for the hedge delay.
+    window = 200
+
+    def __init__(self, hosts=(), server=None, percentile=0.95, minimum_samples=20, smoothing=0.2):
+        self.groups = [tuple(group) for group in hosts]
+        self.server = server
+        self.percentile = percentile
+        self.minimum_samples = minimum_samples
+        self.smoothing = smoothing
+        self.latency = {}
+        self._recent = deque(maxlen=self.window)
+        self._lock = threading.Lock()
+
+    def urls(self, url):
+        """Returns url and the same URL on each of its mirrors, fastest first"""
+        parts = urllib.parse.urlsplit(url)
+        hosts = [parts.hostname]
+        for group in self.groups:
+            if parts.hostname in group:
+                hosts += [host for host in group if host not in hosts]
+        if self.server is not None and self.server not in hosts:
+            hosts.append(self.server)
+        with self._lock:
+            hosts.sort(key=lambda host: self.latency.get(host, 0.0))
+        return [url if host == parts.hostname else urllib.parse.urlunsplit(parts._replace(netloc=rehost(parts, host)))
+                for host in hosts]
+
+    def observe(self, url, seconds):
+        """Records the response time of a request for url"""
+        host = urllib.parse.urlsplit(url).hostname
+        metrics.observe('mirror_latency_seconds', seconds, host)
+        with self._lock:
+            self._recent.append(seconds)
+            previous = self.latency.get(host)
+            if previous is None:
+                self.latency[host] = seconds
+            else:
+                self.latency[host] = previous + self.smoothing * (seconds - previous)
+
+    def failed(self, url):
+        """Ranks the host of a request that failed behind the others"""
+        host = urllib.parse.urlsplit(url).hostname
+        metrics.count('mirror_errors', host=host)
+        with self._lock:
+            slowest = max(self.latency.values(), default=1.0)
+            self.latency[host] = 2 * max(slowest, self.latency.get(host, 0.0))
+
+    def delay(self):
+        """Returns the seconds after which a request is hedged, or None until enough responses have been seen"""
+        if self.percentile is None:
+            return None
+        with self._lock:
+            if len(self._recent) < self.minimum_samples:
+                return None
+            ordered = sorted(self._recent)
+        return percentile(ordered, self.percentile)
+
+
+def rehost(parts, host):
+    """Returns the network location of the URL parts with host in place of their host name"""
+    netloc = host
+    if parts.port is not None:
+        netloc += ':{}'.format(parts.port)
+    if '@' in parts.netloc:
+        netloc = parts.netloc.rsplit('@', 1)[0] + '@' + netloc
+    return netloc
@@ -0,0 +1,35 @@
+#!/usr/bin/python
+
+import sys
+import threading
+
+
+class Output(object):
+    """Progress messages printed while crawling, silenced in quiet mode.
+
+    The stages of the download pipeline print from their own threads, so every line is written whole in one call
+    under a lock; a message printed without newline is held by its thread until the thread ends the line."""
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self._lock = threading.Lock()
+        self._line = threading.local()
+
+    def info(self, message, newline=True):
+        if self.quiet:
+            return
+        line = getattr(self._line, 'text', '') + message
+        if not newline:
+            self._line.text = line
+            return
+        self._line.text = ''
+        with self._lock:
+            sys.stdout.write(line + '\n')
+
+
+# Output of the running process, configured by Manager from -q.
+output = Output()
+
+
+def print_info(message, newline=True):
+    output.info(message, newline)
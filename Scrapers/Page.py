@@ -0,0 +1,48 @@
+#!/usr/bin/python
+
+import io
+
+
+class Page(object):
+    """A page of a chapter as yielded by Crawler.page_stream: its number from 1, image URL and file extension, and
+    either its bytes (recompressed with a Recompressor, size being the bytes downloaded) or the error it failed with,
+    one of download_errors. A page of page_stream(..., stream=True) has a body to read instead of its bytes."""
+
+    __slots__ = ('page', 'url', 'extension', 'data', 'size', 'error', 'body')
+
+    def __init__(self, page, url, extension, data=None, size=None, error=None, body=None):
+        self.page = page
+        self.url = url
+        self.extension = extension
+        self.data = data
+        self.size = size
+        self.error = error
+        self.body = body
+
+    def __repr__(self):
+        return 'Page({!r}, {!r}, {!r}, {} bytes, {!r})'.format(self.page, self.url, self.extension,
+                                                              len(self.data) if self.data is not None else None,
+                                                              self.error)
+
+
+class PageBody(object):
+    """File-like body of a page: the bytes already read of its image, then, when image is given, the rest of the
+    image read from the network as it is read"""
+
+    def __init__(self, data, image=None):
+        self._data = io.BytesIO(data)
+        self._image = image
+
+    def read(self, amt=None):
+        data = self._data.read(amt)
+        if self._image is None:
+            return data
+        if amt is None:
+            rest = self._image.read()
+            return data + rest if data else rest
+        return data or self._image.read(amt)
+
+    def close(self):
+        if self._image is not None:
+            self._image.close()
+            self._image = None
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+from Scrapers.Lock import replaced_file
+from Scrapers.Metrics import metrics
+from Scrapers.Transport import download_errors
+import hashlib
+import json
+import os
+import re
+import threading
+
+CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', re.I)
+
+
+class PartialDownloads(object):
+    """Images whose download was cut off, kept in directory as a .part file of the bytes received so far and a .json
+    file of the URL, validator and length they came with, so that only the rest is asked for with a Range request,
+    also by a later run. Only images sent without Content-Encoding and with a strong ETag or a Last-Modified date
+    are kept; the files of an image are removed once it has been read to the end. The directory is only made when
+    a file is written to it, and removed once it is empty."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def headers(self, url):
+        """Returns the Range and If-Range headers to continue an image from its .part file, or None"""
+        saved = self._load(url)
+        if saved is None:
+            return None
+        return {'Range': 'bytes={}-'.format(saved['size']), 'If-Range': saved['validator']}
+
+    def open(self, url, response, transport, priority=0):
+        """Returns a file-like object reading the image at url from response, which answered a request sent with
+        the headers of headers(url). The image is continued with Range requests sent through transport with the
+        scheduler priority when the connection drops, and kept in a .part file when it is not read to the end."""
+        return Resumable(self, url, response, transport, priority)
+
+    def discard(self, url):
+        """Removes the files of an image, and the directory once it holds no other"""
+        with self._lock:
+            for path in (self._path(url, 'part'), self._path(url, 'json')):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            try:
+                os.rmdir(self.directory)
+            except OSError:
+                pass
+
+    def _load(self, url):
+        try:
+            with open(self._path(url, 'json'), 'r') as f:
+                saved = json.load(f)
+            saved['size'] = os.path.getsize(self._path(url, 'part'))
+        except (OSError, ValueError):
+            return None
+        if saved.get('url') != url or not 0 < saved['size'] < saved['length']:
+            self.discard(url)
+            return None
+        return saved
+
+    def _create(self, url, validator, length):
+        """Starts the .part file of an image and returns it opened for appending"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with replaced_file(self._path(url, 'json')) as f:
+                json.dump({"url": url, "validator": validator, "length": length}, f)
+                part = open(self._path(url, 'part'), 'wb')
+        return part
+
+    def _path(self, url, extension):
+        return os.path.join(self.directory, '{}.{}'.format(hashlib.sha1(url.encode('utf-8')).hexdigest(), extension))
+
+
+class Resumable(object):
+    """Reads an image from its .part file, then from the response. When the connection drops the rest is asked for
+    again from where it stopped, up to retries times: with a Range request, or by fetching the whole image again and
+    skipping what was already read when the server ignores the range but the image has not changed.
+    What the response sends is kept in memory, and only written to a .part file for a later run when the image is
+    closed before its end or once more than spill_size bytes have been read, so that a page read in one go is not
+    written twice."""
+
+    retries = 3
+    block_size = 64 * 1024
+    spill_size = 1024 * 1024
+
+    def __init__(self, parts, url, response, transport, priority=0):
+        self.parts = parts
+        self.url = url
+        self.transport = transport
+        self.priority = priority
+        self.response = response
+        self.position = 0
+        self.validator = None
+        self.length = None
+        self._attempts = 0
+        self._prefix = None
+        self._part = None
+        # Bytes read that are not in the .part file yet, None when the image can't be continued by a later run.
+        self._kept = None
+
+        saved = parts._load(url)
+        start = content_range_start(response)
+        if saved is not None and response.status == 206 and start == saved['size']:
+            self.validator = saved['validator']
+            self._prefix = open(parts._path(url, 'part'), 'rb')
+            self._part = open(parts._path(url, 'part'), 'ab')
+            metrics.count('range_resumes')
+            metrics.count('range_resumed_bytes', start)
+            return
+        if saved is not None:
+            parts.discard(url)
+        if response.status == 206:
+            # Not the range that was asked for.
+            response.close()
+            response = self.response = transport.request(response.url, priority=priority)
+        length = total_length(response)
+        if response.status == 200 and resumable(response) and length is not None:
+            self.validator = validator(response)
+            self.length = length
+            self._kept = bytearray()
+
+    def read(self, amt=None):
+        if amt is None:
+            return b''.join(iter(lambda: self.read(self.block_size), b''))
+        if self._prefix is not None:
+            data = self._prefix.read(amt)
+            if data:
+                self.position += len(data)
+                return data
+            self._prefix.close()
+            self._prefix = None
+
+        while True:
+            try:
+                data = self.response.read(amt)
+                break
+            except download_errors as e:
+                self._resume(e)
+        if data:
+            if self._part is not None:
+                self._part.write(data)
+            elif self._kept is not None:
+                self._kept += data
+                if len(self._kept) > self.spill_size:
+                    self._spill()
+            self.position += len(data)
+        else:
+            self._kept = None
+            if self._part is not None:
+                self._part.close()
+                self._part = None
+                self.parts.discard(self.url)
+        return data
+
+    def close(self):
+        """Closes the response, keeping an image that was not read to the end in a .part file"""
+        if self._prefix is not None:
+            self._prefix.close()
+            self._prefix = None
+        self._spill()
+        if self._part is not None:
+            self._part.close()
+            self._part = None
+        self.response.close()
+
+    def _spill(self):
+        """Writes the bytes kept in memory to the .part file, starting it if needed"""
+        if not self._kept:
+            return
+        if self._part is None:
+            self._part = self.parts._create(self.url, self.validator, self.length)
+        self._part.write(self._kept)
+        self._kept = bytearray()
+
+    def _resume(self, error):
+        """Replaces the response that failed with error by one that continues from position, or raises error"""
+        while self.validator is not None and self._attempts < self.retries:
+            self.response.close()
+            self._attempts += 1
+            try:
+                self.response = self.transport.request(self.response.url, headers={
+                    'Range': 'bytes={}-'.format(self.position), 'If-Range': self.validator}, priority=self.priority)
+                if self.response.status == 206 and content_range_start(self.response) == self.position:
+                    metrics.count('range_resumes')
+                    metrics.count('range_resumed_bytes', self.position)
+                    return
+                if self.response.status == 200 and validator(self.response) == self.validator:
+                    # The server does not do ranges: the image is sent again from its start.
+                    metrics.count('range_refetches')
+                    if self._skip(self.position):
+                        return
+                break
+            except download_errors as e:
+                error = e
+        self.response.close()
+        raise error
+
+    def _skip(self, size):
+        """Reads and drops the first size bytes of the response, returning False if it is shorter"""
+        while size > 0:
+            block = self.response.read(min(self.block_size, size))
+            if not block:
+                return False
+            size -= len(block)
+        return True
+
+
+def validator(response):
+    """Returns the strong ETag or the Last-Modified date of a response, or None"""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def resumable(response):
+    """Tells whether the body of a response can be continued with a Range request"""
+    return (validator(response) is not None and
+            (response.headers.get('Content-Encoding') or 'identity').lower() == 'identity' and
+            (response.headers.get('Accept-Ranges') or '').lower() != 'none')
+
+
+def total_length(response):
+    try:
+        return int(response.headers['Content-Length'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def content_range_start(response):
+    """Returns the first byte of a 206 Partial Content response, or None"""
+    match = CONTENT_RANGE.match(response.headers.get('Content-Range') or '')
+    if response.status != 206 or match is None:
+        return None
+    return int(match.group(1))
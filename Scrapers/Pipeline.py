@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+import queue
+import threading
+
+# Put in a queue after its last item.
+STOP = object()
+# Result of an item whose stage raised.
+FAILED = object()
+
+
+class Pipeline(object):
+    """Passes items through stages, each run by its own number of worker threads, connected by queues of at most
+    queue_size items, so that a stage gets at most that far ahead of the next one and blocks until it catches up.
+    Every stage hands its results on in the order of the items, whichever of its workers finishes first.
+
+    stages is a list of (function, workers) pairs; every function takes the result of the previous stage."""
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, items):
+        """Runs every item through the stages and returns the results of the last stage, in the order of the items.
+        If a stage raises, no new items are started and the error is raised again once the others are done."""
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        remaining = [workers for _, workers in self.stages]
+        # Results of every stage that wait for those of earlier items, and the position of the next one to hand on.
+        finished = [{} for _ in self.stages]
+        following = [0 for _ in self.stages]
+        locks = [threading.Lock() for _ in self.stages]
+        results = []
+        errors = []
+
+        def hand_on(index, position, item):
+            with locks[index]:
+                finished[index][position] = item
+                while following[index] in finished[index]:
+                    item = finished[index].pop(following[index])
+                    if index + 1 < len(queues):
+                        queues[index + 1].put((following[index], item))
+                    elif item is not FAILED:
+                        results.append(item)
+                    following[index] += 1
+
+        def work(index):
+            function = self.stages[index][0]
+            while True:
+                entry = queues[index].get()
+                if entry is STOP:
+                    # Leaves the marker for the other workers of the stage; the last one passes it on.
+                    queues[index].put(STOP)
+                    with locks[index]:
+                        remaining[index] -= 1
+                        last = remaining[index] == 0
+                    if last and index + 1 < len(queues):
+                        queues[index + 1].put(STOP)
+                    return
+                position, item = entry
+                if errors or item is FAILED:
+                    item = FAILED
+                else:
+                    try:
+                        item = function(item)
+                    except BaseException as e:
+                        errors.append(e)
+                        item = FAILED
+                hand_on(index, position, item)
+
+        threads = [threading.Thread(target=work, args=(index,), daemon=True)
+                   for index, (_, workers) in enumerate(self.stages) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for position, item in enumerate(items):
+            if errors:
+                break
+            queues[0].put((position, item))
+        queues[0].put(STOP)
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return results
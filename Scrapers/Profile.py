@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+from contextlib import contextmanager
+from Scrapers.Metrics import metrics
+import os
+import sys
+import threading
+import time
+
+
+class Profiler(object):
+    """Samples the stacks of the threads that are in a named phase of a run (series fetch, image fetch, ...).
+
+    Every interval seconds a sampling thread takes the stack of each thread that is inside a phase() block and
+    counts it for the innermost phase the thread is in, so that pages downloaded by many worker threads at once are
+    profiled as well as the main thread. Until start() is called, phase() does nothing. The samples are written as
+    one file of folded stacks per phase, which flamegraph.pl and speedscope read."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = {}
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    @contextmanager
+    def phase(self, name):
+        """Counts the stacks sampled in the with block for the phase name and observes its seconds as
+        phase_<name>_seconds"""
+        if self._thread is None:
+            yield
+            return
+        ident = threading.get_ident()
+        start = time.perf_counter()
+        with self._lock:
+            self._phases.setdefault(ident, []).append(name)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._phases[ident].pop()
+                if not self._phases[ident]:
+                    del self._phases[ident]
+            metrics.observe('phase_{}_seconds'.format(name), time.perf_counter() - start)
+
+    def drain(self):
+        """Returns the samples taken so far and starts over, to hand them to another process"""
+        with self._lock:
+            samples, self.samples = self.samples, {}
+        return samples
+
+    def merge(self, samples):
+        """Adds the samples drained from another Profiler"""
+        with self._lock:
+            for name, stacks in samples.items():
+                counts = self.samples.setdefault(name, {})
+                for stack, count in stacks.items():
+                    counts[stack] = counts.get(stack, 0) + count
+
+    def write(self, directory):
+        """Writes the samples of every phase to <directory>/<phase>.folded and returns the number of samples"""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            samples = dict((name, dict(stacks)) for name, stacks in self.samples.items())
+        for name, stacks in samples.items():
+            with open(os.path.join(directory, name + '.folded'), 'w') as f:
+                for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                    f.write('{} {}\n'.format(stack, count))
+        return sum(sum(stacks.values()) for stacks in samples.values())
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, names in self._phases.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counts = self.samples.setdefault(names[-1], {})
+                        stack = fold(frame)
+                        counts[stack] = counts.get(stack, 0) + 1
+
+
+def fold(frame):
+    """Returns a stack as a line of folded stacks, from the outermost call to frame"""
+    calls = []
+    while frame is not None:
+        code = frame.f_code
+        calls.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(calls))
+
+
+profiler = Profiler()
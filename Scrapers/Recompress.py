@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+from concurrent.futures import ProcessPoolExecutor
+from Scrapers.Metrics import metrics
+import io
+import threading
+
+# Pillow's Image module, imported by pillow() once a Recompressor is made so that runs without recompression do not
+# pay for it.
+Image = None
+
+
+class Recompressor(object):
+    """Transcodes pages to image_format and shrinks those larger than max_size pixels on their longest side, in a
+    pool of worker processes so that the encoding does not hold back the downloads, or in the calling thread when
+    workers is 0. Needs Pillow. The worker processes are started when the Recompressor is made, which Manager.session
+    does before the download threads start: a process forked while other threads run can deadlock on the locks they
+    held.
+
+    A page is kept as downloaded when it can't be decoded, is animated or would not get smaller."""
+
+    extensions = {'jpeg': 'jpg', 'png': 'png', 'webp': 'webp'}
+
+    def __init__(self, image_format='jpeg', quality=85, max_size=None, workers=None):
+        check_format(image_format)
+        self.image_format = image_format
+        self.quality = quality
+        self.max_size = max_size
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        if workers != 0:
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+            # The pool only forks its processes for the first task, which also has them import Pillow.
+            self._executor.submit(has_pillow).result()
+
+    def recompress(self, data, extension):
+        """Returns the (bytes, extension) of a page to archive in place of data"""
+        with metrics.timer('recompress_seconds'):
+            if self.workers == 0:
+                result = transcode(data, self.image_format, self.quality, self.max_size)
+            else:
+                future = self._executor.submit(transcode, data, self.image_format, self.quality, self.max_size)
+                result = future.result()
+        metrics.count('recompress_bytes_in', len(data))
+        if result is None:
+            metrics.count('recompress_bytes_out', len(data))
+            return data, extension
+        metrics.count('recompress_bytes_out', len(result))
+        metrics.count('pages_recompressed')
+        return result, self.extensions[self.image_format]
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def pillow():
+    """Returns Pillow's Image module, importing it on first use, or None if Pillow is not installed"""
+    global Image
+    if Image is None:
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+    return Image
+
+
+def check_format(image_format):
+    """Raises ImportError when Pillow is not installed and ValueError when image_format is not one a Recompressor
+    writes, without starting any worker process"""
+    if pillow() is None:
+        raise ImportError('Recompressing pages needs Pillow (https://python-pillow.org/)')
+    if image_format not in Recompressor.extensions:
+        raise ValueError('Unsupported image format: {}'.format(image_format))
+
+
+def has_pillow():
+    """Returns whether Pillow is installed, importing it"""
+    return pillow() is not None
+
+
+def transcode(data, image_format, quality, max_size):
+    """Returns data encoded as image_format, or None if it should be kept as it is. Runs in a worker process."""
+    pillow()
+    try:
+        image = Image.open(io.BytesIO(data))
+        if getattr(image, 'is_animated', False):
+            return None
+        image.load()
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+    resized = max_size is not None and max(image.size) > max_size
+    if resized:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    if image_format == 'png':
+        image.save(output, 'PNG', optimize=True)
+    else:
+        image.save(output, image_format.upper(), quality=quality)
+    # A smaller original is kept unless the page had to be shrunk.
+    if len(output.getvalue()) >= len(data) and not resized:
+        return None
+    return output.getvalue()
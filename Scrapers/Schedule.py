@@ -0,0 +1,36 @@
+#!/usr/bin/python
+
+import random
+
+
+class Schedule(object):
+    """When to poll a series page next, adapted to how often the series gets new chapters.
+
+    Once two polls have found new chapters, the series is polled four times per average gap between them, or per
+    time since its last release if that is longer, so that a series on hiatus is polled less and less. Until then
+    every poll that finds nothing doubles the interval. Intervals stay within [minimum, maximum] seconds and are
+    spread by up to jitter (a fraction) so that series added together are not all polled at the same time."""
+
+    # Releases remembered to estimate the gap between them.
+    history = 8
+
+    def __init__(self, minimum=600.0, maximum=86400.0, jitter=0.1):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.jitter = jitter
+        self.interval = minimum
+        self.releases = []
+
+    def update(self, now, found):
+        """Records a poll at time now that found (or not) new chapters and returns the time of the next poll"""
+        if found:
+            self.releases = (self.releases + [now])[-self.history:]
+        if len(self.releases) >= 2:
+            gap = (self.releases[-1] - self.releases[0]) / (len(self.releases) - 1)
+            self.interval = max(gap, now - self.releases[-1]) / 4
+        elif found:
+            self.interval = self.minimum
+        else:
+            self.interval *= 2
+        self.interval = min(self.maximum, max(self.minimum, self.interval))
+        return now + self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+from Scrapers.Metrics import metrics
+import heapq
+import itertools
+import threading
+import time
+
+
+class ByteRate(object):
+    """Allows rate bytes per second on average, in bursts of up to one second's worth. Bytes are paid for once they
+    have been received, so a read that overdraws the allowance makes the next one wait."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def spend(self, size):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate) - size
+            self._updated = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Scheduler(object):
+    """Hands out the connections of a process to the requests of every series downloaded in it, and caps the bytes
+    per second they receive, in total (rate) and per host (host_rate).
+
+    Up to connections requests are in flight at a time, from when they are sent until their body has been read.
+    When more are waiting, the series with the fewest requests in flight gets the next connection, the one served
+    least recently among equals, so that a series with a long back catalog does not hold back the others; within a
+    series, the request with the highest priority (the newest chapter) goes first, then the one waiting longest.
+    depth is the number of requests waiting."""
+
+    def __init__(self, connections=8, rate=None, host_rate=None):
+        self.connections = max(1, connections)
+        self.rate = ByteRate(rate) if rate else None
+        self.host_rate = host_rate
+        self.active = 0
+        self._in_flight = {}
+        self._waiting = {}
+        # Sequence number of the last connection given to each series in flight or waiting.
+        self._served = {}
+        self._hosts = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def depth(self):
+        with self._condition:
+            return sum(len(waiting) for waiting in self._waiting.values())
+
+    def acquire(self, series, priority=0):
+        """Waits for a connection for a request of series and returns the seconds it waited"""
+        with self._condition:
+            if self.active < self.connections and not self._waiting:
+                self._grant(series)
+                return 0.0
+            # Entries are [-priority, arrival, granted] so that the heap of a series pops its most urgent request.
+            entry = [-priority, next(self._sequence), False]
+            heapq.heappush(self._waiting.setdefault(series, []), entry)
+            metrics.observe('scheduler_queue_depth', sum(len(waiting) for waiting in self._waiting.values()))
+            start = time.monotonic()
+            while not entry[2]:
+                self._condition.wait()
+        waited = time.monotonic() - start
+        metrics.observe('scheduler_wait_seconds', waited)
+        return waited
+
+    def release(self, series):
+        """Gives back the connection of a request of series whose body has been read or closed"""
+        with self._condition:
+            self.active -= 1
+            self._in_flight[series] -= 1
+            if not self._in_flight[series]:
+                del self._in_flight[series]
+                if series not in self._waiting:
+                    del self._served[series]
+            while self.active < self.connections and self._waiting:
+                waiting = min(self._waiting, key=self._share)
+                entry = heapq.heappop(self._waiting[waiting])
+                if not self._waiting[waiting]:
+                    del self._waiting[waiting]
+                entry[2] = True
+                self._grant(waiting)
+            self._condition.notify_all()
+
+    def spend(self, host, size):
+        """Waits until size bytes just received from host fit in the byte-rate caps"""
+        if self.rate is not None:
+            self.rate.spend(size)
+        if self.host_rate:
+            with self._condition:
+                if host not in self._hosts:
+                    self._hosts[host] = ByteRate(self.host_rate)
+                rate = self._hosts[host]
+            rate.spend(size)
+
+    def _share(self, series):
+        """Sort key of the series waiting for a connection: fewest in flight first, then least recently served"""
+        return self._in_flight.get(series, 0), self._served.get(series, -1)
+
+    def _grant(self, series):
+        self.active += 1
+        self._in_flight[series] = self._in_flight.get(series, 0) + 1
+        self._served[series] = next(self._sequence)
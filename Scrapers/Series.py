@@ -0,0 +1,18 @@
+#!/usr/bin/python
+
+from Scrapers.Chapter import Record
+
+
+class Series(Record):
+    """Metadata of a series, read once from its series page, a Record like Chapter: series["title"]."""
+
+    __slots__ = ('title', 'author', 'artist', 'description')
+
+    def __init__(self, title, author=None, artist=None, description=None):
+        self.title = title
+        self.author = author
+        self.artist = artist
+        self.description = description
+
+    def __repr__(self):
+        return 'Series({!r}, {!r}, {!r}, {!r})'.format(self.title, self.author, self.artist, self.description)
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+from Scrapers.Lock import file_lock, replaced_file
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class DownloadState(object):
+    """Manifest of the chapters already downloaded into a directory, kept as JSON next to the archives.
+
+    Each chapter is recorded under its archive name with its URL, page count, the archive entry of every page that
+    was written, the pages that failed and the size, modification time and SHA-1 of the archive. Processes that
+    share the directory merge their records into the file under a file_lock on a .lock file next to it, which is
+    removed once they are merged. The records of this process are written at most every save_interval seconds,
+    and by flush()."""
+
+    filename = '.mangacrawler.json'
+    save_interval = 30
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.filename)
+        self._lock_path = self.path + '.lock'
+        self._lock = threading.Lock()
+        # Chapters recorded since the file was last written.
+        self._updated = set()
+        self._saved = time.time()
+        try:
+            with open(self.path, 'r') as f:
+                self.chapters = json.load(f).get('chapters', {})
+        except (OSError, ValueError):
+            self.chapters = {}
+
+    def chapter(self, name):
+        """Returns the record of an archive, or None if it was never downloaded or has changed since"""
+        record = self.chapters.get(name)
+        if record is None:
+            return None
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return None
+        if stat.st_size != record['size']:
+            return None
+        if stat.st_mtime != record['mtime'] and self.checksum(name) != record['sha1']:
+            return None
+        return record
+
+    def is_complete(self, name):
+        record = self.chapter(name)
+        return record is not None and not record['missing']
+
+    def update(self, name, chapter, pages, entries, missing, checksum=True):
+        """Records an archive that was just written. entries maps page numbers to archive entry names.
+        Without checksum the archive is not read, and the record only holds while the archive keeps its
+        modification time."""
+        stat = os.stat(os.path.join(self.directory, name))
+        record = {
+            "chapter": chapter["chapter"],
+            "url": chapter["url"],
+            "pages": pages,
+            "entries": {str(page): entry for page, entry in entries.items()},
+            "missing": sorted(missing),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha1": self.checksum(name) if checksum else None}
+        with self._lock:
+            self.chapters[name] = record
+            self._updated.add(name)
+            if time.time() - self._saved >= self.save_interval:
+                self._save()
+
+    def flush(self):
+        """Writes the chapters recorded since the file was last written"""
+        with self._lock:
+            if self._updated:
+                self._save()
+
+    def _save(self):
+        # Other processes of a batch run may have recorded chapters in the same directory since it was loaded.
+        with file_lock(self._lock_path):
+            try:
+                with open(self.path, 'r') as f:
+                    chapters = json.load(f).get('chapters', {})
+            except (OSError, ValueError):
+                chapters = {}
+            chapters.update((name, self.chapters[name]) for name in self._updated)
+            self.chapters = chapters
+            with replaced_file(self.path) as f:
+                json.dump({"chapters": self.chapters}, f, separators=(',', ':'))
+        self._updated.clear()
+        self._saved = time.time()
+
+    def checksum(self, name):
+        sha1 = hashlib.sha1()
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+
+from Scrapers.Lock import replaced_file
+from Scrapers.Metrics import metrics
+import hashlib
+import os
+import tempfile
+
+
+class ImageStore(object):
+    """Content-addressed store of page images shared by every chapter and series downloaded with it.
+
+    Images are kept once under objects/ named after the SHA-1 of their content, however many chapters use them.
+    urls/ maps the SHA-1 of every image URL fetched to the hash of its content, so that a page whose URL was already
+    fetched is taken from the store without asking the site again. Both are plain files, which several processes can
+    add to at the same time."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        for name in ('objects', 'urls', 'tmp'):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def lookup(self, url):
+        """Returns the content hash of an image URL that was stored before, or None"""
+        try:
+            with open(self._url_path(url), 'r') as f:
+                digest = f.read().strip()
+        except OSError:
+            return None
+        if not os.path.exists(self._object_path(digest)):
+            return None
+        return digest
+
+    def open(self, digest):
+        """Opens a stored image for reading, counting it as a page that did not have to be downloaded"""
+        f = open(self._object_path(digest), 'rb')
+        metrics.count('store_hits')
+        metrics.count('store_hit_bytes', os.fstat(f.fileno()).st_size)
+        return f
+
+    def intake(self, url, stream):
+        """Returns a file-like object reading stream that also adds what is read to the store as the image of url.
+        The image is only stored once it has been read to the end."""
+        return Intake(self, url, stream)
+
+    def add(self, url, temporary, digest, size):
+        """Moves a completely read image from temporary into the store, unless the same content is there already"""
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            os.remove(temporary)
+            metrics.count('store_duplicates')
+            metrics.count('store_duplicate_bytes', size)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temporary, path)
+            metrics.count('store_objects')
+        with replaced_file(self._url_path(url)) as f:
+            f.write(digest)
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def _url_path(self, url):
+        return os.path.join(self.directory, 'urls', hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+
+class Intake(object):
+    """Reads an image from a stream while hashing it into a temporary file of the store"""
+
+    def __init__(self, store, url, stream):
+        self.store = store
+        self.url = url
+        self.stream = stream
+        self.size = 0
+        self._sha1 = hashlib.sha1()
+        descriptor, self._temporary = tempfile.mkstemp(dir=os.path.join(store.directory, 'tmp'))
+        self._file = os.fdopen(descriptor, 'wb')
+
+    def read(self, amt=None):
+        data = self.stream.read(amt)
+        if self._file is None:
+            return data
+        if data:
+            self._sha1.update(data)
+            self._file.write(data)
+            self.size += len(data)
+        if amt is None or not data and amt != 0:
+            self._file.close()
+            self._file = None
+            self.store.add(self.url, self._temporary, self._sha1.hexdigest(), self.size)
+        return data
+
+    def close(self):
+        """Drops the temporary file of an image that was not read to the end"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._temporary)
+        self.stream.close()
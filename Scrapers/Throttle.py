@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Allows rate requests per second on average, in bursts of up to burst requests."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimit(object):
+    """Number of requests allowed to wait for their response at the same time, adjusted AIMD style.
+
+    The limit grows by one per limit successful responses (additive increase) and is halved (multiplicative
+    decrease) on a throttled or failed request, or when responses get much slower than the fastest seen. It is
+    lowered at most once per cooldown seconds so that one burst of errors does not collapse it to the minimum."""
+
+    def __init__(self, maximum, minimum=1, latency_factor=4.0, cooldown=1.0):
+        self.maximum = max(minimum, maximum)
+        self.minimum = minimum
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self.fastest = None
+        self._decreased = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, hedge=False):
+        """Waits for a free slot. A hedge of a slow request may go over the limit by up to half the maximum, as it
+        would otherwise wait for the request it is meant to overtake."""
+        allowance = max(1, self.maximum // 2) if hedge else 0
+        with self._condition:
+            while self.in_flight >= int(self.limit) + allowance:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, congested=False):
+        with self._condition:
+            self.in_flight -= 1
+            if latency is not None and not congested:
+                if self.fastest is None or latency < self.fastest:
+                    self.fastest = latency
+                congested = latency > self.fastest * self.latency_factor and latency > 0.05
+            if congested:
+                now = time.monotonic()
+                if now - self._decreased >= self.cooldown:
+                    self._decreased = now
+                    self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class Throttle(object):
+    """Per-host request rate limit, adaptive concurrency and retry policy shared by the requests of a run.
+
+    Failed requests are retried up to retries times, waiting backoff * 2 ** attempt seconds (with jitter, at most
+    max_backoff) or as long as the server asks in Retry-After."""
+
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, rate=None, burst=1, concurrency=8, retries=3, backoff=1.0, max_backoff=60.0):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, name):
+        """Returns the (TokenBucket or None, AdaptiveLimit) of a host"""
+        with self._lock:
+            if name not in self._hosts:
+                bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+                self._hosts[name] = (bucket, AdaptiveLimit(self.concurrency))
+            return self._hosts[name]
+
+    def delay(self, attempt, retry_after=None):
+        """Returns how many seconds to wait before retry number attempt (starting at 0)"""
+        if retry_after is not None:
+            try:
+                seconds = float(retry_after)
+            except ValueError:
+                try:
+                    seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    seconds = None
+            if seconds is not None:
+                return min(self.max_backoff, max(0.0, seconds))
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
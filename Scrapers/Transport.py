@@ -0,0 +1,336 @@
+#!/usr/bin/python
+
+from Scrapers.Metrics import metrics
+import functools
+import http.client
+import http.cookiejar
+import logging
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+
+
+# Errors that fail the download of a single page or chapter rather than the whole run.
+download_errors = (urllib.error.URLError, http.client.HTTPException, ConnectionError, socket.timeout)
+
+
+class Response(object):
+    """File-like body of an HTTP response, decompressed on the fly while it is read.
+    The connection is handed back to the transport once the body has been read to the end. A body that ends before
+    its Content-Length raises http.client.IncompleteRead instead of passing for a complete one, after the bytes that
+    did arrive have been returned. waited is the seconds the request waited for a connection of the Scheduler before
+    it was sent."""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, transport, key, connection, response, url):
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._transport = transport
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._buffer = b''
+        self._host = key[1]
+        # Length of the body as sent (compressed), None when the server did not say.
+        self._expected = response.length
+        self._received = 0
+        # Error the body failed with, raised once the bytes read before it have been handed over.
+        self._error = None
+        # Gives the connection of the Scheduler back, once the body has been read or closed.
+        self._slot = None
+        self.waited = 0.0
+
+        encoding = (response.headers.get('Content-Encoding') or '').lower()
+        if encoding == 'gzip':
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decoder = zlib.decompressobj()
+        else:
+            self._decoder = None
+
+    def info(self):
+        return self.headers
+
+    def read(self, amt=None):
+        if self._error is not None and (amt is None or not self._buffer):
+            error, self._error = self._error, None
+            raise error
+        try:
+            if amt is None:
+                chunks = [self._buffer]
+                while self._response is not None:
+                    chunks.append(self._decode(self._response.read(self.chunk_size)))
+                self._buffer = b''
+                return b''.join(chunks)
+
+            while self._response is not None and len(self._buffer) < amt:
+                self._buffer += self._decode(self._response.read(self.chunk_size))
+        except BaseException as e:
+            # A body that fails halfway (timeout, reset connection) gives its connection and scheduler slot back.
+            self.close()
+            if amt is None or not self._buffer or not isinstance(e, Exception):
+                raise
+            # The bytes that did arrive are handed over first, so that a resume starts after them.
+            self._error = e
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._connection.close()
+            self._response = None
+        self._free()
+
+    def _free(self):
+        slot, self._slot = self._slot, None
+        if slot is not None:
+            slot()
+
+    def _decode(self, data):
+        metrics.count('bytes', len(data), self._host)
+        self._received += len(data)
+        if data and self._transport.scheduler is not None:
+            self._transport.scheduler.spend(self._host, len(data))
+        if not data and self._expected is not None and self._received < self._expected:
+            metrics.count('truncated', host=self._host)
+            self.close()
+            raise http.client.IncompleteRead(b'', self._expected - self._received)
+        if not data:
+            if self._decoder is not None:
+                tail = self._decoder.flush()
+            else:
+                tail = b''
+            self._transport.release(self._key, self._connection, self._response)
+            self._response = None
+            self._free()
+            return tail
+        if self._decoder is None:
+            return data
+        try:
+            return self._decoder.decompress(data)
+        except zlib.error:
+            # Some servers send raw deflate streams without the zlib header.
+            if self._decoder.unused_data == b'' and self._response.headers.get('Content-Encoding') == 'deflate':
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                return self._decoder.decompress(data)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Transport(object):
+    """Keeps persistent HTTP(S) connections per host together with the default headers that every request of a
+    scraper sends and its cookies. cookies are sent to cookie_domain and its subdomains, and a cookie set by a server
+    only to the hosts it is meant for, so that mirrors and image hosts of other domains get none.
+    Requests go through the optional Throttle, which limits the rate and the number of requests waiting for a response
+    per host and retries the failed ones, and through the optional Scheduler, which shares the connections and
+    bandwidth of the process among the series downloaded in it, series being the one this transport requests for."""
+
+    redirect_codes = (301, 302, 303, 307, 308)
+
+    def __init__(self, headers=None, cookies=None, pool_size=4, timeout=60, max_redirects=10, throttle=None,
+                 scheduler=None, series=None, cookie_domain=None):
+        self.headers = {'Accept-encoding': 'gzip, deflate'}
+        self.headers.update(headers or {})
+        self.cookies = http.cookiejar.CookieJar()
+        for name, value in (cookies or {}).items():
+            self.cookies.set_cookie(domain_cookie(name, value, cookie_domain))
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.throttle = throttle
+        self.scheduler = scheduler
+        self.series = series
+        self.proxies = urllib.request.getproxies()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def request(self, url, headers=None, hedge=False, priority=0):
+        """Sends a GET request for url following redirects and returns its Response. hedge marks a second request
+        for a slow one, which the throttle lets through beyond its concurrency limit; the scheduler sends the requests
+        of the series with the highest priority first.
+        Raises urllib.error.HTTPError for error statuses and urllib.error.URLError when the server can't be reached,
+        like urllib.request.urlopen."""
+        for _ in range(self.max_redirects + 1):
+            response = self._attempt(url, headers, hedge, priority)
+            if response.status in self.redirect_codes and response.headers.get('Location'):
+                with response:
+                    response.read()
+                url = urllib.parse.urljoin(url, response.headers['Location'])
+                logging.debug('Redirected to %s', url)
+                continue
+            if response.status >= 400:
+                with response:
+                    response.read()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            return response
+        raise urllib.error.HTTPError(url, response.status, 'Too many redirects', response.headers, None)
+
+    def release(self, key, connection, response):
+        """Returns a connection whose response has been read completely to the idle pool"""
+        if response.will_close:
+            connection.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            self._idle.clear()
+
+    def _attempt(self, url, headers, hedge=False, priority=0):
+        """Sends a request within the throttle limits of its host, retrying it while the server is throttling,
+        failing or unreachable"""
+        host = urllib.parse.urlsplit(url).hostname
+        if self.throttle is None:
+            metrics.count('requests', host=host)
+            waited = self._schedule(priority)
+            try:
+                return self._assign(self._send(url, headers), waited)
+            except (OSError, http.client.HTTPException) as e:
+                self._unschedule()
+                metrics.count('request_errors', host=host)
+                raise urllib.error.URLError(e)
+
+        bucket, limit = self.throttle.host(host)
+        attempt = 0
+        while True:
+            # The scheduler comes first so that the most urgent requests are the ones waiting on the throttle.
+            waited = self._schedule(priority)
+            if bucket is not None:
+                bucket.acquire()
+            limit.acquire(hedge)
+            metrics.count('requests', host=host)
+            start = time.monotonic()
+            try:
+                response = self._assign(self._send(url, headers), waited)
+            except (OSError, http.client.HTTPException) as e:
+                self._unschedule()
+                limit.release(congested=True)
+                if attempt >= self.throttle.retries:
+                    metrics.count('request_errors', host=host)
+                    raise urllib.error.URLError(e)
+                wait = self.throttle.delay(attempt)
+                logging.debug('Retrying %s in %.1fs: %s', url, wait, e)
+            else:
+                latency = time.monotonic() - start
+                metrics.observe('request_latency_seconds', latency, host)
+                throttled = response.status in self.throttle.retry_statuses
+                limit.release(latency=latency, congested=throttled)
+                if not throttled or attempt >= self.throttle.retries:
+                    return response
+                wait = self.throttle.delay(attempt, response.headers.get('Retry-After'))
+                logging.debug('Retrying %s in %.1fs: HTTP %d', url, wait, response.status)
+                with response:
+                    response.read()
+            metrics.count('retries', host=host)
+            time.sleep(wait)
+            attempt += 1
+
+    def _schedule(self, priority):
+        """Waits for a connection of the scheduler and returns the seconds waited"""
+        if self.scheduler is None:
+            return 0.0
+        return self.scheduler.acquire(self.series, priority)
+
+    def _unschedule(self):
+        """Gives back the connection of a request that failed before it got a Response"""
+        if self.scheduler is not None:
+            self.scheduler.release(self.series)
+
+    def _assign(self, response, waited):
+        """Makes response give the connection of the scheduler back once its body has been read or closed"""
+        if self.scheduler is not None:
+            response.waited = waited
+            response._slot = functools.partial(self.scheduler.release, self.series)
+        return response
+
+    def _send(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        key = self._connection_key(parts)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if key[3] is not None and parts.scheme == 'http':
+            # Plain HTTP through a proxy is sent with the absolute URI.
+            path = urllib.parse.urlunsplit((parts.scheme, parts.netloc, path, '', ''))
+
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        # The cookie jar matches cookies by urllib requests, which only carry the URL here.
+        cookie_request = urllib.request.Request(url)
+        self.cookies.add_cookie_header(cookie_request)
+        if cookie_request.has_header('Cookie'):
+            request_headers['Cookie'] = cookie_request.get_header('Cookie')
+
+        # A pooled connection may have been closed by the server meanwhile, so retry once on a fresh one.
+        while True:
+            connection, reused = self._acquire(key)
+            try:
+                connection.request('GET', path, headers=request_headers)
+                response = connection.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if not reused:
+                    raise
+            except Exception:
+                connection.close()
+                raise
+
+        self.cookies.extract_cookies(response, cookie_request)
+        return Response(self, key, connection, response, url)
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port, proxy = key
+        if proxy is not None:
+            proxy_parts = urllib.parse.urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(proxy_parts.hostname, proxy_parts.port or 8080,
+                                                         timeout=self.timeout)
+                connection.set_tunnel(host, port)
+            else:
+                connection = http.client.HTTPConnection(proxy_parts.hostname, proxy_parts.port or 8080,
+                                                        timeout=self.timeout)
+        elif scheme == 'https':
+            connection = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return connection, False
+
+    def _connection_key(self, parts):
+        default_port = 443 if parts.scheme == 'https' else 80
+        proxy = self.proxies.get(parts.scheme)
+        if proxy is not None and urllib.request.proxy_bypass(parts.hostname):
+            proxy = None
+        return parts.scheme, parts.hostname, parts.port or default_port, proxy
+
+
+def domain_cookie(name, value, domain):
+    """Returns a cookie sent to every path of domain and its subdomains, or of every host when domain is None"""
+    return http.cookiejar.Cookie(0, name, value, None, False, '.' + domain if domain else '', bool(domain),
+                                 bool(domain), '/', False, False, None, False, None, None, {})
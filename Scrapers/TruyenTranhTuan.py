@@ -1,61 +1,70 @@
 # /usr/bin/python3.5
 
-from __main__ import print_info
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
+from Scrapers.Chapter import Chapter
 from Scrapers.Crawler import Crawler
-import gzip
-import io
+from Scrapers.Metrics import metrics
+from Scrapers.Output import print_info
+from Scrapers.Profile import profiler
+from Scrapers.Series import Series
 import logging
 import re
-import urllib.request, urllib.error, urllib.parse
-from functools import cmp_to_key
+
+
+CHAPTER_NUMBER = re.compile(r'(\w+)-chuong-(\w+)', flags=re.IGNORECASE)
+# The image list of a chapter page, as a script variable: slides_page_path lists the images out of order.
+SLIDES = re.compile(rb'var (slides_page_path|slides_page_url_path) = \["(.+)"\];')
+SLIDES_TEXT = re.compile(r'var (slides_page_path|slides_page_url_path) = \["(.+)"\];')
+PAGE_INDEX = re.compile(r'.*-([0-9]*)\.([A-Za-z]*)')
 
 
 class TruyenTranhTuan(Crawler):
     site_name = 'TruyenTranhTuan'
     uses_groups = False
+    cookies = {'vns_Adult': 'yes'}
 
-    def __init__(self, url):
+    def __init__(self, url, **kwargs):
         self.url = url
-        super(TruyenTranhTuan, self).__init__(url)
+        super(TruyenTranhTuan, self).__init__(url, **kwargs)
         match_chapter = re.match(r'(.+)truyentranhtuan\.com\/(.+)-chuong-(\d+)', url, flags=re.IGNORECASE)
         if match_chapter:
             self.chapter_number = match_chapter.group(3)
-            self.page = BeautifulSoup(self.open_url(self.chapter_series(url)), "html.parser")
             self.init_with_chapter = True
+            self.series = self.series_metadata(self.parse(self.chapter_series(url), 'series'))
+            self.chapters = [Chapter(self.chapter_number, "Chapter " + str(self.chapter_number), self.url)]
             logging.debug('Object initialized with chapter')
         else:
-            self.page = BeautifulSoup(self.open_url(url), "html.parser")
             self.init_with_chapter = False
             self.chapter_number = 0
+            page = self.parse(url, 'series')
+            self.series = self.series_metadata(page)
+            with metrics.timer('parse_chapter_list_seconds'), profiler.phase('chapter_list'):
+                chapter_row = page.find("div", {"id": "manga-chapter"}).find_all("span", {"class": "chapter-name"})
+                self.chapters = [self.chapter_info(chapter.find("a")) for chapter in chapter_row]
             logging.debug('Object initialized with series')
-        logging.debug('Object created with ' + url)
+        logging.debug('Object created with %s', url)
 
     def chapter_series(self, url):
         """Returns the series page for an individual chapter URL.
         Useful for scraping series metadata for an individual chapter"""
         return url
 
-    # Returns a dictionary containing chapter number, chapter name and chapter URL.
+    # Returns a Chapter with the chapter number, chapter name and chapter URL.
     def chapter_info(self, chapter_data):
-        logging.debug('Fetching chapter info')
         chapter_url = str(chapter_data['href'])
 
-        chapter_number = re.search(r'(\w+)-chuong-(\w+)', chapter_url, flags=re.IGNORECASE).group(2)
+        chapter_number = CHAPTER_NUMBER.search(chapter_url).group(2)
 
-        logging.debug('Manga Name: {}'.format(self.series_info('title')))
-        logging.debug('Chapter number: {}'.format(chapter_number))
-        logging.debug('Chapter name: ' + str(chapter_data.text))
-        logging.debug('Chapter URL: ' + chapter_url)
+        logging.debug('Chapter %s: %s (%s)', chapter_number, chapter_data.text, chapter_url)
 
-        return {"chapter": chapter_number, "name": chapter_data.text, "url": chapter_url}
+        return Chapter(chapter_number, chapter_data.text, chapter_url)
 
     # Returns the image URL for the page.
     def chapter_images(self, chapter_url):
         logging.debug('Fetching chapter images')
         image_list = []
 
-        page = BeautifulSoup(self.open_url(chapter_url.encode('ascii', 'ignore').decode('utf-8')), "html.parser")
+        page = self.parse(chapter_url.encode('ascii', 'ignore').decode('utf-8'), 'chapter')
         scripts = page.find("div", {"id": "containerRoot"}).find_all('script')
         for script in scripts:
             if re.search(r'lstImages', script.text):
@@ -63,128 +72,82 @@ class TruyenTranhTuan(Crawler):
                     image_list.append(re.search(r'lstImages\.push\("(.*)"\);', match).group(1))
                 break
 
-        logging.debug('Chapter images: ' + str(image_list))
+        logging.debug('Chapter images: %s', image_list)
         return image_list
 
-    def download_chapter(self, chapter, download_directory, download_name):
-        files = []
+    def chapter_pages(self, chapter):
+        url = chapter["url"].encode('ascii', 'ignore').decode('utf-8')
+        match, html = self.scan(url, 'chapter', SLIDES, b'var slides_page')
+        if match is not None:
+            return image_list(match.group(1).decode('ascii'), match.group(2).decode('utf-8'))
+
+        # The page layout changed: look for the list in the scripts of the parsed page.
+        logging.debug('Image list not found by scanning %s', url)
+        metrics.count('scan_fallbacks')
+        page = self.soup(html, 'chapter', SoupStrainer('script'))
+        for script in page.find_all('script'):
+            match = SLIDES_TEXT.search(script.text)
+            if match:
+                return image_list(match.group(1), match.group(2))
+        return []
+
+    def download_chapter(self, chapter, download_directory, download_name, image_urls=None, finish=None):
         warnings = []
         logging.debug('\n************************************************')
-        logging.debug('Downloading chapter {}.'.format(chapter["url"]))
-        page = BeautifulSoup(self.open_url(chapter["url"].encode('ascii', 'ignore').decode('utf-8')), "html.parser")
-        scripts = page.find_all('script')
+        logging.debug('Downloading chapter %s.', chapter["url"])
+        if image_urls is None:
+            image_urls = self.chapter_pages(chapter)
         # TODO
         chapter_name = chapter["url"].strip('/').split('/')
         chapter_name = chapter_name[len(chapter_name) - 1]
+
+        # Pages are numbered by their position among the downloaded ones, so a failed page leaves no gap.
         image_name = 1
-        for script in scripts:
-            if re.search(r'(var slides_page_path = \[")(.+)("\];)', script.text):
-                image_url = re.search(r'(var slides_page_path = \[")(.+)("\];)', script.text).group(2)
-                need_short = 1
-            elif re.search(r'(var slides_page_url_path = \[")(.+)("\];)', script.text):
-                image_url = re.search(r'(var slides_page_url_path = \[")(.+)("\];)', script.text).group(2)
-                need_short = 0
-            else:
+        filename = download_directory + '/' + download_name
+        pages = self.download_pages(chapter, image_urls, filename, self.entry_name(chapter), finish)
+        for image_url, error in zip(image_urls, list(pages)):
+            logging.debug('Downloaded image %s', image_url)
+            if error is not None:
+                print_info('WARNING: Unable to download file ({}).'.format(str(error)))
+                warnings.append(self.page_warning(image_name, chapter))
                 continue
+            image_name += 1
 
-            image_urls = image_url.split('","')
-            if need_short == 1:
-                image_urls = sorted(image_urls, key=cmp_to_key(cmp_items))
-
-            for image_url in image_urls:
-                if image_url == '':
-                    continue
-
-                file_extension = re.search(r'.*\.([A-Za-z]*)', image_url).group(1)
-                logging.debug('Downloading image ' + image_url)
-                req = urllib.request.Request(image_url, headers={
-                    'User-agent': self.default_user_agent(),
-                    'Accept-encoding': 'gzip'})
-                try:
-                    response = urllib.request.urlopen(req)
-                except urllib.error.HTTPError as e:
-                    print_info('WARNING: Unable to download file ({}).'.format(str(e)))
-                    warnings.append(
-                        'Download of page {}, chapter {:g}, series "{}" failed.'.format(image_name, chapter["chapter"],
-                                                                                        self.series_info('title')))
-                    continue
-                filename = '{}/{}-{:06d}.{}'.format(download_directory, chapter_name, image_name, file_extension)
-                f = open(filename, 'wb')
-                f.write(response.read())
-                f.close()
-                logging.debug('Saved image ' + filename)
-                files.append(filename)
-                image_name += 1
-            break
-
-        filename = download_directory + '/' + download_name
-        self.zip_files(files, filename)
-        logging.debug('Finished {} Chapter'.format(chapter_name))
+        logging.debug('Finished %s Chapter', chapter_name)
 
         return warnings
 
-    # Function designed to create a request object with correct headers, open the URL and decompress it if it's gzipped.
-    def open_url(self, url):
-        logging.debug("Opening URL: " + url)
-        headers = {
-            'User-agent': self.default_user_agent(),
-            'Accept-encoding': 'gzip', 'Cookie': 'vns_Adult=yes'}
-        req = urllib.request.Request(url, headers=headers)
-        response = urllib.request.urlopen(req)
-
-        if response.info().get('Content-Encoding') == 'gzip':
-            buf = io.BytesIO(response.read())
-            data = gzip.GzipFile(fileobj=buf, mode="rb")
-            return data
-        else:
-            return response.read()
+    def entry_name(self, chapter):
+        chapter_name = chapter["url"].strip('/').split('/')[-1]
+        return lambda page, position, extension: '{}-{:06d}.{}'.format(chapter_name, position, extension)
 
     def series_chapters(self):
-        chapters = []
-        if self.init_with_chapter:
-            logging.debug('Fetching single chapters')
-            chapters.append(
-                {"chapter": self.chapter_number, "name": "Chapter " + str(self.chapter_number), "url": self.url}
-            )
+        logging.debug('Fetching series chapters of %s', self.series.title)
+        return self.chapters[::-1]
+
+    def series_metadata(self, page):
+        if not self.init_with_chapter:
+            title = page.find("h1", {"itemprop": "name"}).text.strip()
+            description = page.find("div", {"id": "manga-summary"}).find("p").text.strip('\n')
         else:
-            # If the object was initialized with a chapter, only return the chapters.
-            logging.debug('Fetching series chapters')
-            chapter_row = self.page.find("div", {"id": "manga-chapter"}).find_all("span", {"class": "chapter-name"})
-
-            for chapter in chapter_row:
-                chapters.append(self.chapter_info(chapter.find("a")))
-
-        return chapters[::-1]
-
-    def series_info(self, search):
-        def title():
-            if not self.init_with_chapter:
-                return self.page.find("h1", {"itemprop": "name"}).text.strip()
-            else:
-                return self.page.find("a", {"class": "mangaName"}).text.strip()
-
-        def description():
-            if not self.init_with_chapter:
-                return self.page.find("div", {"id": "manga-summary"}).find("p").text.strip('\n')
-            else:
-                # @todo Get for specific chapter
-                return ""
-
-        def author():
-            return self.page.select('a[href*="/danh-sach-truyen/"]')[0].text.title()
-
-        options = {"title": title, "description": description, "author": author}
-        return options[search]()
-
-
-def cmp_items(a, b):
-    image_index_a = re.search(r'.*-([0-9]*)\.([A-Za-z]*)', a).group(1)
-    image_index_a = int(image_index_a)
-    image_index_b = re.search(r'.*-([0-9]*)\.([A-Za-z]*)', b).group(1)
-    image_index_b = int(image_index_b)
-    if image_index_a > image_index_b:
-        return 1
-    elif image_index_a == image_index_b:
-        return 0
-    else:
-        return -1
+            title = page.find("a", {"class": "mangaName"}).text.strip()
+            # @todo Get for specific chapter
+            description = ""
+        try:
+            author = page.select('a[href*="/danh-sach-truyen/"]')[0].text.title()
+        except IndexError:
+            author = None
+        return Series(title, author, description=description)
+
+
+def image_list(variable, value):
+    """Returns the image URLs listed in the value of a slides_page_path or slides_page_url_path variable"""
+    image_urls = [image_url for image_url in value.split('","') if image_url != '']
+    if variable == 'slides_page_path':
+        image_urls.sort(key=page_index)
+    return image_urls
+
+
+def page_index(image_url):
+    """Sort key of an image URL: the page number at the end of its file name"""
+    return int(PAGE_INDEX.search(image_url).group(1))
@@ -1,2 +1,19 @@
-from .DynastyReader import DynastyReader
-from .TruyenTranhTuan import TruyenTranhTuan
+import importlib
+import re
+import urllib.parse
+
+# Host pattern and module (holding the class of the same name) of every scraper. Modules are imported on first use
+# so that starting up, or crawling one site, does not load the others.
+SCRAPERS = (
+    (re.compile(r'(^|\.)dynasty-scans\.com$', flags=re.IGNORECASE), 'DynastyReader'),
+    (re.compile(r'(^|\.)truyentranhtuan\.com$', flags=re.IGNORECASE), 'TruyenTranhTuan'),
+)
+
+
+def scraper(url):
+    """Returns the scraper class for the site of url, or None if no scraper supports it"""
+    host = urllib.parse.urlsplit(url if '//' in url else '//' + url).hostname or ''
+    for pattern, name in SCRAPERS:
+        if pattern.search(host):
+            return getattr(importlib.import_module('.' + name, __name__), name)
+    return None
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+"""Offline end-to-end benchmark of the crawler.
+
+Starts the stand-in site server from benchmarks/server.py and, for each supported site, runs both Manager.py and
+the scraper classes against it through http_proxy. Every scenario runs in its own process so that its peak RSS can
+be measured. Reports chapters/s, pages/s, MB/s and peak RSS as JSON, and per-phase timings (series fetch, chapter
+list, download) for the scraper classes, whose phases run one after the other in the benchmark process."""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS)
+
+from server import add_arguments, create_server
+
+SITES = {
+    'dynasty': 'http://dynasty-scans.com/series/benchmark_series',
+    'truyentranhtuan': 'http://truyentranhtuan.com/benchmark-series/',
+}
+
+
+def archive_totals(directory):
+    """Returns the number of archives, pages and bytes written to directory"""
+    archives = pages = size = 0
+    for name in os.listdir(directory):
+        if name.endswith('.zip') or name.endswith('.cbz'):
+            path = os.path.join(directory, name)
+            with zipfile.ZipFile(path) as archive:
+                pages += len(archive.infolist())
+            archives += 1
+            size += os.path.getsize(path)
+    return archives, pages, size
+
+
+def summarize(result, wall_time, directory):
+    chapters, pages, size = archive_totals(directory)
+    result.update({
+        'wall_time': round(wall_time, 4),
+        'chapters': chapters,
+        'pages': pages,
+        'bytes': size,
+        'chapters_per_s': round(chapters / wall_time, 3),
+        'pages_per_s': round(pages / wall_time, 3),
+        'mb_per_s': round(size / wall_time / 1024 / 1024, 3)})
+    return result
+
+
+def run_library(site, workers, directory):
+    """Runs a scraper class in this process and returns its result with per-phase timings"""
+    import resource
+    from Scrapers import scraper
+    from Scrapers.Output import output
+
+    output.quiet = True
+    url = SITES[site]
+    manga_class = scraper(url)
+    phases = {}
+    warnings = []
+
+    start = time.perf_counter()
+    manga = manga_class(url, page_workers=workers)
+    phases['series_fetch'] = time.perf_counter() - start
+
+    phase_start = time.perf_counter()
+    chapters = manga.series_chapters()
+    phases['chapter_list'] = time.perf_counter() - phase_start
+
+    phase_start = time.perf_counter()
+    for number, chapter in enumerate(chapters, start=1):
+        warnings += manga.download_chapter(chapter, directory, '{:04d}.zip'.format(number))
+    phases['download'] = time.perf_counter() - phase_start
+    wall_time = time.perf_counter() - start
+
+    result = {'site': site, 'mode': 'library', 'workers': workers, 'warnings': len(warnings),
+              'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              'phases': dict((name, round(value, 4)) for name, value in phases.items())}
+    return summarize(result, wall_time, directory)
+
+
+def run_manager(site, workers, directory, proxy):
+    """Runs Manager.py in a child process and returns its result"""
+    environment = dict(os.environ, http_proxy=proxy, HOME=directory)
+    command = [sys.executable, os.path.join(ROOT, 'Manager.py'), '-q', '-t', str(workers), '-d', directory,
+               SITES[site]]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=directory, env=environment, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+
+    result = {'site': site, 'mode': 'manager', 'workers': workers, 'exit_status': os.WEXITSTATUS(status),
+              'warnings': output.decode('utf-8', 'replace').count(' failed.'), 'peak_rss_kb': usage.ru_maxrss}
+    return summarize(result, wall_time, directory)
+
+
+def run_scenario(args, site, mode, proxy):
+    """Runs one scenario in a fresh process so its peak RSS is its own"""
+    directory = tempfile.mkdtemp(prefix='mangacrawler-bench-')
+    try:
+        if mode == 'manager':
+            return run_manager(site, args.workers, directory, proxy)
+        command = [sys.executable, os.path.abspath(__file__), '--scenario', site, '--workers', str(args.workers),
+                   '--directory', directory]
+        output = subprocess.check_output(command, env=dict(os.environ, http_proxy=proxy))
+        return json.loads(output.decode('utf-8'))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    parser.add_argument('--workers', type=int, default=4, help='pages downloaded in parallel (default: 4)')
+    parser.add_argument('--sites', default=','.join(sorted(SITES)), help='comma separated sites to benchmark')
+    parser.add_argument('--modes', default='library,manager', help='comma separated: library, manager')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--directory', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario is not None:
+        print(json.dumps(run_library(args.scenario, args.workers, args.directory)))
+        return
+
+    server = create_server(args)
+    server.start()
+    results = []
+    for site in args.sites.split(','):
+        for mode in args.modes.split(','):
+            results.append(run_scenario(args, site, mode, server.proxy))
+            print('{site:>16} {mode:>8}: {wall_time:8.3f}s {chapters_per_s:8.2f} chapters/s {pages_per_s:8.2f} '
+                  'pages/s {mb_per_s:8.2f} MB/s {peak_rss_kb:8d} KB'.format(**results[-1]), file=sys.stderr)
+    server.shutdown()
+
+    report = {
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'settings': {'chapters': args.chapters, 'pages': args.pages, 'image_size': args.image_size,
+                     'latency': args.latency, 'bandwidth': args.bandwidth, 'error_rate': args.error_rate,
+                     'workers': args.workers},
+        'server': {'requests': server.requests, 'bytes_sent': server.bytes_sent},
+        'results': results}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
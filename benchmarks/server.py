@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+
+"""Local stand-in for the supported sites, used to benchmark the crawler offline.
+
+The server works as an HTTP proxy: point http_proxy at it and every request for dynasty-scans.com or
+truyentranhtuan.com is answered from the HTML fixtures in benchmarks/fixtures, with generated chapter lists and
+synthetic images of a fixed size. Latency, bandwidth and the rate of failed image requests are configurable."""
+
+from string import Template
+import argparse
+import gzip
+import hashlib
+import http.server
+import os
+import random
+import re
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as f:
+        return Template(f.read())
+
+
+class Site(object):
+    """Content of the stand-in sites: one series per site with chapters chapters of pages pages each."""
+
+    title = 'Benchmark Series'
+    author = 'Benchmark Author'
+    description = 'Synthetic series served by the benchmark server.'
+
+    def __init__(self, chapters=20, pages=20, image_size=200 * 1024):
+        self.chapters = chapters
+        self.pages = pages
+        self.image_size = image_size
+        self._images = {}
+        self._lock = threading.Lock()
+        self._templates = dict((name, fixture(name + '.html')) for name in (
+            'dynasty_series', 'dynasty_chapter', 'truyentranhtuan_series', 'truyentranhtuan_chapter'))
+
+    def get(self, host, path):
+        """Returns (content type, body) for a URL, or None if it does not exist"""
+        path = re.sub('/+', '/', path)
+        if re.search(r'\.(jpg|png|webp|gif)$', path):
+            return 'image/jpeg', self.image(path)
+        if 'dynasty-scans.com' in host:
+            return self._dynasty(path)
+        if 'truyentranhtuan.com' in host:
+            return self._truyentranhtuan(host, path)
+        return None
+
+    def image(self, path):
+        """Returns the bytes of a synthetic, incompressible image that is the same on every request"""
+        with self._lock:
+            if path not in self._images:
+                seed = int(hashlib.sha1(path.encode('utf-8')).hexdigest()[:8], 16)
+                body = random.Random(seed).getrandbits(8 * self.image_size).to_bytes(self.image_size, 'little')
+                self._images[path] = b'\xff\xd8\xff\xe0' + body[4:]
+            return self._images[path]
+
+    def values(self, **extra):
+        values = {'title': self.title, 'author': self.author, 'author_slug': 'benchmark_author',
+                  'description': self.description, 'series_slug': 'benchmark_series'}
+        values.update(extra)
+        return values
+
+    def _dynasty(self, path):
+        if path.startswith('/series/'):
+            chapters = '\n'.join(
+                '        <dd><a class="name" href="/chapters/benchmark_series_ch{0:02d}">Chapter {0}: Part {0}</a>'
+                ' <small>released Jan {1}, 2016</small></dd>'.format(n, 1 + n % 28)
+                for n in range(1, self.chapters + 1))
+            body = self._templates['dynasty_series'].substitute(self.values(chapters=chapters))
+            return 'text/html', body.encode('utf-8')
+        match = re.match(r'/chapters/benchmark_series_ch(\d+)$', path)
+        if match and 1 <= int(match.group(1)) <= self.chapters:
+            chapter = int(match.group(1))
+            images = ['/system/releases/000/{0:03d}/benchmark_series_ch{0:02d}/{1:03d}.jpg'.format(chapter, n)
+                      for n in range(1, self.pages + 1)]
+            pages = ','.join('{{"image":"{}","name":"{}"}}'.format(image, n) for n, image in enumerate(images, 1))
+            body = self._templates['dynasty_chapter'].substitute(self.values(chapter=chapter, pages=pages,
+                                                                             first_image=images[0]))
+            return 'text/html', body.encode('utf-8')
+        return None
+
+    def _truyentranhtuan(self, host, path):
+        if path.rstrip('/') == '/benchmark-series':
+            chapters = '\n'.join(
+                '  <span class="chapter-name"><a href="http://{0}/benchmark-series-chuong-{1}/">'
+                'Benchmark Series {1}</a></span>'.format(host, n) for n in range(self.chapters, 0, -1))
+            body = self._templates['truyentranhtuan_series'].substitute(self.values(chapters=chapters))
+            return 'text/html', body.encode('utf-8')
+        match = re.match(r'/benchmark-series-chuong-(\d+)/?$', path)
+        if match and 1 <= int(match.group(1)) <= self.chapters:
+            chapter = int(match.group(1))
+            images = ['http://i.{0}/images/benchmark-series-{1}-{2}.jpg'.format(host, chapter, n)
+                      for n in range(1, self.pages + 1)]
+            # The site lists the pages out of order; the scraper sorts them.
+            random.Random(chapter).shuffle(images)
+            pages = ','.join('"{}"'.format(image) for image in images)
+            body = self._templates['truyentranhtuan_chapter'].substitute(self.values(chapter=chapter, pages=pages))
+            return 'text/html', body.encode('utf-8')
+        return None
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are sent separately: with Nagle's algorithm the body of a small response would wait for the
+    # delayed ACK of the keep-alive client, about 40 ms a request.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        parts = urllib.parse.urlsplit(self.path)
+        host = parts.netloc or self.headers.get('Host', '')
+        with server.lock:
+            server.requests += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        content = server.site.get(host, parts.path)
+        if content is None:
+            return self.send_empty(404, 'Not Found')
+        content_type, body = content
+        if content_type.startswith('image/') and server.random.random() < server.error_rate:
+            return self.send_empty(503, 'Service Unavailable')
+
+        headers = {'Content-Type': content_type}
+        if content_type == 'text/html':
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                return self.send_empty(304, 'Not Modified', {'ETag': etag})
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                headers['Content-Encoding'] = 'gzip'
+
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.send_body(body)
+        with server.lock:
+            server.bytes_sent += len(body)
+
+    def send_empty(self, code, message, headers=None):
+        self.send_response(code, message)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_body(self, body):
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        # Throttles every response to the bandwidth in bytes per second, in 10 ms slices.
+        chunk = max(1, int(bandwidth / 100))
+        for offset in range(0, len(body), chunk):
+            self.wfile.write(body[offset:offset + chunk])
+            time.sleep(0.01)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchmarkServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, site, latency=0.0, bandwidth=0, error_rate=0.0, seed=0):
+        super(BenchmarkServer, self).__init__(address, Handler)
+        self.site = site
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+
+    def handle_error(self, request, client_address):
+        # Clients that hang up early, as the crawler does with the body of a hedged or failed request, are expected.
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super(BenchmarkServer, self).handle_error(request, client_address)
+
+    @property
+    def proxy(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def add_arguments(parser):
+    parser.add_argument('--chapters', type=int, default=20, help='chapters in each series (default: 20)')
+    parser.add_argument('--pages', type=int, default=20, help='pages in each chapter (default: 20)')
+    parser.add_argument('--image-size', type=int, default=200 * 1024, help='bytes per image (default: 204800)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes per second per response (0: unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of image requests that fail')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the error sampling')
+
+
+def create_server(args, address=('127.0.0.1', 0)):
+    site = Site(chapters=args.chapters, pages=args.pages, image_size=args.image_size)
+    return BenchmarkServer(address, site, latency=args.latency, bandwidth=args.bandwidth,
+                           error_rate=args.error_rate, seed=args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = create_server(args, ('127.0.0.1', args.port))
+    print('Serving on {}; use http_proxy={}'.format(server.proxy, server.proxy))
+    server.serve_forever()
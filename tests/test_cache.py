@@ -0,0 +1,82 @@
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scrapers.Cache import HttpCache
+
+
+def store_pages(directory, prefix, count):
+    cache = HttpCache(directory)
+    for number in range(count):
+        cache.store('http://example.com/{}/{}'.format(prefix, number), {'ETag': '"{}"'.format(number)}, b'page')
+
+
+class HttpCacheTest(unittest.TestCase):
+    """Merging of the index.json of a cache directory shared by several caches"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def index(self):
+        with open(os.path.join(self.directory, 'index.json'), 'r') as f:
+            return json.load(f)
+
+    def test_merge(self):
+        first = HttpCache(self.directory)
+        second = HttpCache(self.directory)
+        first.store('http://example.com/1', {'ETag': '"1"'}, b'one')
+        second.store('http://example.com/2', {'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}, b'two')
+        self.assertEqual(sorted(entry['url'] for entry in self.index().values()),
+                         ['http://example.com/1', 'http://example.com/2'])
+        # Each cache has read the entries of the other once it wrote the index.
+        self.assertEqual(second.validators('http://example.com/1'), {'If-None-Match': '"1"'})
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'index.lock')))
+
+    def test_hits_merged(self):
+        first = HttpCache(self.directory)
+        first.store('http://example.com/1', {'ETag': '"1"'}, b'one')
+        stored = self.index()[first._key('http://example.com/1')]['accessed']
+
+        second = HttpCache(self.directory)
+        self.assertEqual(second.hit('http://example.com/1'), b'one')
+        first.store('http://example.com/2', {'ETag': '"2"'}, b'two')
+        second.flush()
+        index = self.index()
+        self.assertEqual(len(index), 2)
+        self.assertGreater(index[first._key('http://example.com/1')]['accessed'], stored)
+
+    def test_evict_least_recently_used(self):
+        first = HttpCache(self.directory, max_size=6)
+        second = HttpCache(self.directory, max_size=6)
+        first.store('http://example.com/1', {'ETag': '"1"'}, b'one')
+        second.store('http://example.com/2', {'ETag': '"2"'}, b'two')
+        first.hit('http://example.com/1')
+        first.flush()
+        second.store('http://example.com/3', {'ETag': '"3"'}, b'six')
+        self.assertEqual(sorted(entry['url'] for entry in self.index().values()),
+                         ['http://example.com/1', 'http://example.com/3'])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, first._key('http://example.com/2'))))
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+    def test_processes(self):
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=store_pages, args=(self.directory, prefix, 20)) for prefix in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(len(self.index()), 80)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['index.json'] + list(self.index().keys())))
+
+
+if __name__ == '__main__':
+    unittest.main()
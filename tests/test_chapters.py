@@ -0,0 +1,135 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Manager
+from Scrapers.Chapter import Chapter, ChapterList
+from Scrapers.Output import output
+
+
+class Series(object):
+    """Stand-in for a scraper: series_chapters lists the newest chapter first, as the sites do"""
+
+    site_name = 'Test'
+    init_with_chapter = False
+
+    def __init__(self, chapters, uses_groups=True):
+        self.chapters = chapters
+        self.uses_groups = uses_groups
+
+    def series_chapters(self):
+        return list(reversed(self.chapters))
+
+
+def chapters(*numbers, **groups):
+    """Returns a Chapter for each number in reading order, released by the group of its number in groups"""
+    return [Chapter(number, 'Chapter {}'.format(number), 'http://example.com/{}/{}'.format(number, position),
+                    groups.get('g{:g}'.format(number), 'Group')) for position, number in enumerate(numbers)]
+
+
+class ChapterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        quiet, output.quiet = output.quiet, True
+        self.addCleanup(setattr, output, 'quiet', quiet)
+        self.config = Manager.Configuration()
+
+    def select(self, series, **settings):
+        for name, value in settings.items():
+            setattr(self.config, name, value)
+        return [chapter.chapter for chapter in Manager.select_chapters(series, self.config)]
+
+
+class ChapterListTest(ChapterTestCase):
+
+    def test_label(self):
+        self.assertEqual([chapter.label for chapter in chapters(1.0, 12.5, 100.0)], ['1', '12.5', '100'])
+        self.assertEqual(Chapter('Extra', 'Extra', 'http://example.com/extra').label, 'Extra')
+
+    def test_find(self):
+        listed = ChapterList(chapters(1.0, 2.0, 2.0, 3.0))
+        self.assertEqual(listed.find('2'), 1)
+        self.assertEqual(listed.find('2', start=2), 2)
+        self.assertIsNone(listed.find('2', start=3))
+        self.assertIsNone(listed.find('3', stop=3))
+        self.assertIsNone(listed.find('4'))
+
+    def test_duplicates(self):
+        listed = ChapterList(chapters(1.0, 2.0, 2.0, 3.0, 3.0, 3.0))
+        self.assertEqual([[chapter.url for chapter in group] for group in listed.duplicates()],
+                         [[listed[1].url, listed[2].url], [listed[3].url, listed[4].url, listed[5].url]])
+
+
+class RangeTest(ChapterTestCase):
+
+    def setUp(self):
+        super(RangeTest, self).setUp()
+        self.series = Series(chapters(1.0, 2.0, 2.5, 3.0, 4.0, 5.0))
+
+    def test_all(self):
+        self.assertEqual(self.select(self.series), [1.0, 2.0, 2.5, 3.0, 4.0, 5.0])
+
+    def test_start_and_end(self):
+        self.assertEqual(self.select(self.series, chapter_start='2.5', chapter_end='4'), [2.5, 3.0, 4.0])
+
+    def test_limit(self):
+        self.assertEqual(self.select(self.series, chapter_start='2', limit='3'), [2.0, 2.5, 3.0])
+
+    def test_end_beyond_limit(self):
+        # The end chapter is only looked for within the limit.
+        self.assertEqual(self.select(self.series, limit='2', chapter_end='4'), [1.0, 2.0])
+
+    def test_not_found(self):
+        self.assertEqual(self.select(self.series, chapter_start='9', chapter_end='9'),
+                         [1.0, 2.0, 2.5, 3.0, 4.0, 5.0])
+
+    def test_known(self):
+        known = {self.series.chapters[0].url, self.series.chapters[3].url}
+        self.assertEqual([chapter.chapter for chapter in Manager.select_chapters(self.series, self.config, known)],
+                         [2.0, 2.5, 4.0, 5.0])
+
+
+class DuplicatesTest(ChapterTestCase):
+
+    def setUp(self):
+        super(DuplicatesTest, self).setUp()
+        self.releases = chapters(1.0, 2.0, 2.0, 2.0, 3.0)
+        for release, group in zip(self.releases[1:4], ('Alpha', 'Beta', 'Gamma')):
+            release.group = group
+
+    def picked(self, uses_groups=True, **settings):
+        for name, value in settings.items():
+            setattr(self.config, name, value)
+        selected = Manager.select_chapters(Series(self.releases, uses_groups), self.config)
+        self.assertEqual([chapter.chapter for chapter in selected], [1.0, 2.0, 3.0])
+        return selected[1].group
+
+    def test_no_preference(self):
+        # The first release in reading order is kept.
+        self.assertEqual(self.picked(), 'Alpha')
+
+    def test_no_preference_without_groups(self):
+        self.assertEqual(self.picked(uses_groups=False), 'Alpha')
+
+    def test_preference(self):
+        self.assertEqual(self.picked(group_preference='Beta'), 'Beta')
+
+    def test_preference_not_found(self):
+        # The last release in reading order is kept.
+        self.assertEqual(self.picked(group_preference='Delta'), 'Gamma')
+
+    def test_preference_without_groups(self):
+        self.assertEqual(self.picked(uses_groups=False, group_preference='Beta'), 'Alpha')
+
+    def test_interactive(self):
+        with mock.patch('builtins.input', side_effect=['x', '0', '4', '3']) as prompt, \
+                mock.patch('builtins.print'):
+            self.assertEqual(self.picked(interactive_mode=True), 'Gamma')
+        self.assertEqual(prompt.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
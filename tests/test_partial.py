@@ -0,0 +1,156 @@
+import http.server
+import os
+import re
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scrapers.DynastyReader import DynastyReader
+from Scrapers.Partial import PartialDownloads, Resumable
+from Scrapers.Transport import Transport
+
+ETAG = '"image"'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves the image of the server at every path, answering Range requests with If-Range when it does ranges,
+    and sending only the first bytes of a response while the server has cuts left"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.refuse:
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = server.body
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match and server.ranges and self.headers.get('If-Range') == ETAG:
+            start = int(match.group(1))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', ETAG)
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        cut = server.cuts.pop(0) if server.cuts else None
+        if cut is None:
+            self.wfile.write(body[start:])
+            return
+        self.wfile.write(body[start:start + cut])
+        self.wfile.flush()
+        self.connection.shutdown(socket.SHUT_RDWR)
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ImageServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, body):
+        super(ImageServer, self).__init__(('127.0.0.1', 0), Handler)
+        self.body = body
+        self.cuts = []
+        self.ranges = True
+        self.refuse = False
+        self.requests = []
+
+
+class ResumableTest(unittest.TestCase):
+    """Range continuation of images cut off in transit, within a run and across runs"""
+
+    def setUp(self):
+        self.body = bytes(range(256)) * 1200
+        self.server = ImageServer(self.body)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/image.jpg'.format(self.server.server_address[1])
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.parts = PartialDownloads(os.path.join(self.directory, 'parts'))
+        self.transport = Transport()
+        self.addCleanup(self.transport.close)
+
+    def open(self):
+        headers = self.parts.headers(self.url)
+        return self.parts.open(self.url, self.transport.request(self.url, headers), self.transport)
+
+    def test_range_resume(self):
+        self.server.cuts = [100000]
+        image = self.open()
+        self.assertEqual(image.read(), self.body)
+        image.close()
+        self.assertEqual(self.server.requests[1]['Range'], 'bytes=100000-')
+        self.assertEqual(self.server.requests[1]['If-Range'], ETAG)
+        self.assertFalse(os.path.exists(self.parts.directory))
+
+    def test_refetch_and_skip(self):
+        # The server does not say it does ranges and ignores them, but sends the same image again: what was already
+        # read is skipped.
+        self.server.ranges = False
+        self.server.cuts = [100000]
+        image = self.open()
+        self.assertEqual(image.read(), self.body)
+        image.close()
+        self.assertEqual(self.server.requests[1]['Range'], 'bytes=100000-')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_spill_on_close(self):
+        image = self.open()
+        self.assertEqual(len(image.read(70000)), 70000)
+        image.close()
+        self.assertEqual(self.parts.headers(self.url), {'Range': 'bytes=70000-', 'If-Range': ETAG})
+
+        # A later run only asks for the rest.
+        image = self.open()
+        self.assertEqual(image.read(), self.body)
+        image.close()
+        self.assertEqual(self.server.requests[1]['Range'], 'bytes=70000-')
+        self.assertIsNone(self.parts.headers(self.url))
+
+    def test_spill_past_limit(self):
+        with mock.patch.object(Resumable, 'spill_size', 100000):
+            image = self.open()
+            data = image.read(Resumable.block_size) + image.read(Resumable.block_size)
+            # Written to the .part file while the image is still being read.
+            self.assertEqual(self.parts.headers(self.url)['Range'], 'bytes={}-'.format(len(data)))
+            data += image.read()
+            image.close()
+        self.assertEqual(data, self.body)
+        self.assertIsNone(self.parts.headers(self.url))
+
+    def test_range_refused(self):
+        image = self.open()
+        image.read(70000)
+        image.close()
+        self.server.refuse = True
+
+        crawler = DynastyReader(self.url)
+        self.addCleanup(crawler.close)
+        crawler.parts = self.parts
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            crawler.open_image(self.url)
+        self.assertEqual(raised.exception.code, 416)
+        self.assertIsNone(self.parts.headers(self.url))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scrapers.Scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    """Order in which the requests waiting for the one connection of a scheduler get it"""
+
+    def setUp(self):
+        self.scheduler = Scheduler(connections=1)
+        self.order = []
+        self.threads = []
+
+    def wait(self, series, name, priority=0):
+        """Starts a request of series that waits for the connection, records name once it has it and gives it back"""
+        def request():
+            self.scheduler.acquire(series, priority)
+            self.order.append(name)
+            self.scheduler.release(series)
+
+        depth = self.scheduler.depth
+        thread = threading.Thread(target=request, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        deadline = time.monotonic() + 5
+        while self.scheduler.depth == depth:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+    def served(self, series):
+        """Gives back the connection held by a request of series and returns the order the waiting ones got it in"""
+        self.scheduler.release(series)
+        for thread in self.threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(self.scheduler.active, 0)
+        self.assertEqual(self.scheduler.depth, 0)
+        return self.order
+
+    def test_free(self):
+        self.assertEqual(self.scheduler.acquire('a'), 0.0)
+        self.assertEqual(self.scheduler.active, 1)
+        self.scheduler.release('a')
+        self.assertEqual(self.scheduler.active, 0)
+
+    def test_series_alternate(self):
+        self.scheduler.acquire('c')
+        for name in ('a1', 'a2', 'a3', 'b1', 'b2', 'b3'):
+            self.wait(name[0], name)
+        self.assertEqual(self.scheduler.depth, 6)
+        self.assertEqual(self.served('c'), ['a1', 'b1', 'a2', 'b2', 'a3', 'b3'])
+
+    def test_least_recently_served(self):
+        # The series that just had the connection goes after one that has not had it yet.
+        self.scheduler.acquire('a')
+        for name in ('a1', 'a2', 'b1'):
+            self.wait(name[0], name)
+        self.assertEqual(self.served('a'), ['b1', 'a1', 'a2'])
+
+    def test_priority(self):
+        self.scheduler.acquire('a')
+        for name, priority in (('old', 0), ('new', 5), ('middle', 1), ('older', 0)):
+            self.wait('a', name, priority)
+        self.assertEqual(self.served('a'), ['new', 'middle', 'old', 'older'])
+
+
+if __name__ == '__main__':
+    unittest.main()
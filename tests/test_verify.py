@@ -0,0 +1,56 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scrapers.DynastyReader import DynastyReader
+from Scrapers.State import DownloadState
+from Scrapers.TruyenTranhTuan import TruyenTranhTuan
+
+
+class VerifyArchiveTest(unittest.TestCase):
+    """--verify of archives that the download state does not know, as left by earlier versions"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def verify(self, scraper, chapter, entries, pages):
+        # The scrapers are not opened: verify_archive only reads the archive and the download state.
+        crawler = scraper.__new__(scraper)
+        crawler.state = DownloadState(self.directory)
+        filename = os.path.join(self.directory, 'chapter.zip')
+        with zipfile.ZipFile(filename, 'w') as archive:
+            for entry in entries:
+                archive.writestr(entry, entry)
+        image_urls = ['http://example.com/{}.jpg'.format(page) for page in range(1, pages + 1)]
+        return crawler.verify_archive(chapter, image_urls, filename), crawler.state.chapter('chapter.zip')
+
+    def test_names_by_page(self):
+        missing, record = self.verify(DynastyReader, {'chapter': '1', 'url': 'http://example.com/chapters/c1'},
+                                      ['000001.jpg', '000002.jpg', '000004.jpg'], 4)
+        self.assertEqual(missing, [3])
+        self.assertEqual(record['entries'], {'1': '000001.jpg', '2': '000002.jpg', '4': '000004.jpg'})
+
+    def test_names_by_position(self):
+        # Page 3 failed: the pages after it were named 3 to 5, so which page is missing cannot be told.
+        chapter = {'chapter': '1', 'url': 'http://example.com/truyen-chuong-1/'}
+        entries = ['truyen-chuong-1-{:06d}.jpg'.format(position) for position in range(1, 6)]
+        missing, record = self.verify(TruyenTranhTuan, chapter, entries, 6)
+        self.assertEqual(missing, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(record['entries'], {})
+
+    def test_complete_names_by_position(self):
+        chapter = {'chapter': '1', 'url': 'http://example.com/truyen-chuong-1/'}
+        entries = ['truyen-chuong-1-{:06d}.jpg'.format(position) for position in range(1, 7)]
+        missing, record = self.verify(TruyenTranhTuan, chapter, entries, 6)
+        self.assertEqual(missing, [])
+        self.assertEqual(len(record['entries']), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()